@@ -30,6 +30,8 @@ def write_CMD(list_item, target_path):
 
     for x in list_item:
         lenName = len(x[0])
+        # formats like " %ld" leave empty types and length modifiers, eg. ['', 'ld']
+        types = [t.lstrip('hjlLqtz') for t in x[2] if t]
         if x[1] is None and int(x[3]) == 0:  # no param function
             f.write("COMMAND SUCHAI_TARGET " + x[0].upper() + " BIG_ENDIAN " + "\"description\"\n")
             f.write(
@@ -42,7 +44,7 @@ def write_CMD(list_item, target_path):
                 n = 1
                 while n <= int(x[3]):
                     f.write("   APPEND_PARAMETER SPACE_" + str(n) + " 8 STRING \" \"\n")
-                    f.write("   APPEND_PARAMETER " + "VAR " + switcher.get(x[2][n - 1]) + " \"input\"\n")
+                    f.write("   APPEND_PARAMETER " + "VAR " + switcher.get(types[n - 1]) + " \"input\"\n")
                     n += 1
 
             elif x[1] is not None and int(x[3]) == 0:  # more vars scanned than params
@@ -64,7 +66,7 @@ def write_CMD(list_item, target_path):
                 while n <= len(x[1]):
                     f.write("   APPEND_PARAMETER SPACE_" + str(n) + " 8 STRING \" \"\n")
                     f.write(
-                        "   APPEND_PARAMETER " + x[1][n - 1].upper() + " " + switcher.get(x[2][n - 1]) + " \"input\"\n")
+                        "   APPEND_PARAMETER " + x[1][n - 1].upper() + " " + switcher.get(types[n - 1]) + " \"input\"\n")
                     n += 1
 
         f.write("\n")
@@ -53,6 +53,22 @@ def get_name(function):
 
 
 def get_tm(file_path,file_target):
+    file_as_string=file_to_text(file_path)
+    function_list=get_functions(file_as_string)
+    function_data=get_function_data(function_list)
+    write_TM(function_list, function_data, file_target)
+
+
+def write_TM(function_list, function_data, file_target):
+    """writes the telemetry structs in the format of the COSMOS tlm file
+
+            Keyword arguments:
+
+            function_list -- the structs found by get_functions
+            function_data -- the fields of each struct, found by get_function_data
+            file_target -- the path where the new file will be created or overwritten
+
+            """
     switcher = {
         'uint32_t': ' 32 UINT ',
         'int32_t': ' 32 INT ',
@@ -62,9 +78,6 @@ def get_tm(file_path,file_target):
         'char': ' 320 STRING ',
         'char*': ' 320 STRING ',
     }
-    file_as_string=file_to_text(file_path)
-    function_list=get_functions(file_as_string)
-    function_data=get_function_data(function_list)
     f = open(file_target,"w+")
     name_counter=0
     for i in range(0,len(function_list)):
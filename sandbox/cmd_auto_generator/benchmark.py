@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import data_cleaner as DC
+
+
+def write_tree(directory, n_cmds, cmds_per_file=50, brace="}"):
+    """
+    Write a synthetic source tree like src/system/cmd*.c: each file has an init function registering its commands
+    with cmd_add, then one function per command, with and without parameters
+    :param directory: Str. Output directory
+    :param n_cmds: Int. Number of commands
+    :param cmds_per_file: Int. Number of commands per file
+    :param brace: Str. Closing brace of the functions. An indented brace leaves the functions without parameters
+        unterminated, the worst case of the regular expression
+    :return: None
+    """
+    os.makedirs(directory, exist_ok=True)
+    for n_file in range(0, n_cmds, cmds_per_file):
+        names = ["cmd{}_{}".format(n_file // cmds_per_file, i) for i in range(min(cmds_per_file, n_cmds - n_file))]
+        with open(os.path.join(directory, "cmd{}.c".format(n_file // cmds_per_file)), 'w') as f:
+            f.write('#include "repoCommand.h"\n\nstatic const char* tag = "cmd";\n\nvoid cmd_init(void)\n{\n')
+            for i, name in enumerate(names):
+                if i % 3:
+                    f.write('    cmd_add("{0}", {0}, "%d %f", 2);\n'.format(name))
+                else:
+                    f.write('    cmd_add("{0}", {0}, "", 0);\n'.format(name))
+            f.write('}\n\n')
+            for i, name in enumerate(names):
+                f.write('int {}(char *fmt, char *params, int nparams)\n{{\n'.format(name))
+                if i % 3:
+                    f.write('    int value;\n    float gain;\n'
+                            '    if(params == NULL || sscanf(params, fmt, &value, &gain) != nparams)\n'
+                            '    {\n        LOGE(tag, "Invalid params");\n        return CMD_SYNTAX_ERROR;\n    }\n'
+                            '    LOGI(tag, "value: %d, gain: %f", value, gain);\n')
+                else:
+                    f.write('    int i;\n    for(i=0; i<10; i++)\n        printf("%d\\n", i);\n')
+                f.write('    return CMD_OK;\n' + brace + '\n\n')
+
+
+def bench(directory):
+    """
+    Time the regular expressions and the linear extractors over a source tree, checking both give the same tuples
+    :param directory: Str. Source tree
+    :return: None
+    """
+    texts = DC.files_to_string(directory)
+
+    start = time.perf_counter()
+    cmds = DC.data_cleaner_cmd(texts)
+    params = DC.data_cleaner_param(texts)
+    regex = time.perf_counter() - start
+
+    start = time.perf_counter()
+    t_cmds = []
+    t_params = []
+    for text in texts:
+        t_cmds.extend(DC.tokenize_cmd(text))
+        t_params.extend(DC.tokenize_param(text))
+    tokens = time.perf_counter() - start
+    same = (cmds, params) == (t_cmds, t_params)
+
+    start = time.perf_counter()
+    DC.data_cleaner_dict(t_cmds, t_params)
+    join = time.perf_counter() - start
+
+    print("{:6d} commands, regex: {:.3f} s, tokenizer: {:.3f} s ({:.1f}x), join: {:.3f} s, same tuples: {}".format(
+        len(cmds), regex, tokens, regex / tokens, join, same))
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser(description="Benchmark the command extractors on synthetic source trees")
+    parser.add_argument("-n", "--cmds", type=int, nargs="+", default=[500, 1000, 2000, 5000], help="Commands")
+    parser.add_argument("-p", "--path", type=str, help="Also benchmark this source tree")
+    parser.add_argument("-b", "--brace", type=str, default="}", help="Closing brace of the functions, eg. '  }'")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_parameters()
+    for n in args.cmds:
+        tree = tempfile.mkdtemp()
+        try:
+            write_tree(tree, n, brace=args.brace)
+            bench(tree)
+        finally:
+            shutil.rmtree(tree)
+    if args.path:
+        bench(args.path)
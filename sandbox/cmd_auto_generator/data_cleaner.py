@@ -1,5 +1,11 @@
 import re
 import os
+import json
+import hashlib
+from bisect import bisect_left
+
+# Per file extraction results, see files_extract
+CACHE_FILE = ".data_cleaner_cache.json"
 
 def data_cleaner_cmd(TXT):
     """Return a list of tuples, that contains {function user name , function name, type of args, number of args}
@@ -44,6 +50,74 @@ def data_cleaner_param(TXT):
     return cleanData
 
 
+# Tokens of the linear extractors, see tokenize_cmd and tokenize_param
+CMD_TOKEN = "    cmd_add("
+INT_TOKEN = "int "
+SSCANF_TOKEN = "sscanf(params, fmt, &"
+END_TOKEN = "\n}"
+signature = re.compile(r"\((?:char..fmt, char..params, ?int nparams\))(?:\n| ?\{)", flags=re.DOTALL)
+
+
+def tokenize_cmd(text):
+    """Return the same list of tuples as data_cleaner_cmd([text]), scanning the text once
+
+    Keyword arguments:
+
+    text -- the contents of a .c file
+
+    """
+    cleanData = []
+    start = text.find(CMD_TOKEN)
+    while start >= 0:
+        # Only the first cmd_add of a line, up to the last ");" of the line, split at its last 3 commas
+        end = text.find("\n", start)
+        end = len(text) if end < 0 else end
+        line = text[start + len(CMD_TOKEN):end]
+        close = line.rfind(");")
+        if close >= 0:
+            args = line[:close].rsplit(",", 3)
+            if len(args) == 4:
+                cleanData.append(tuple(args))
+        start = text.find(CMD_TOKEN, end)
+    return cleanData
+
+
+def tokenize_param(text):
+    """Return the same list of tuples as data_cleaner_param([text]), without backtracking: function signatures,
+    sscanf and end of function tokens are found once, then joined moving forward
+
+    Keyword arguments:
+
+    text -- the contents of a .c file
+
+    """
+    cleanData = []
+    sscanfs = [m.start() for m in re.finditer(re.escape(SSCANF_TOKEN), text)]
+    ends = [m.start() for m in re.finditer(END_TOKEN, text)]
+    pos = 0
+    for sig in signature.finditer(text):
+        name_end, body = sig.span()
+        # The first "int " followed by a function name of 1 to 47 chars and this signature
+        start = text.find(INT_TOKEN, max(pos, name_end - len(INT_TOKEN) - 47), max(name_end - 1, 0))
+        if start < 0:
+            continue
+        # The body ends at the first sscanf with a closing parenthesis or at the first "\n}"
+        i = bisect_left(sscanfs, body)
+        scanf = sscanfs[i] if i < len(sscanfs) else -1
+        close = text.find(")", scanf + len(SSCANF_TOKEN)) if scanf >= 0 else -1
+        i = bisect_left(ends, body)
+        end = ends[i] if i < len(ends) else -1
+        if close >= 0 and (end < 0 or scanf < end):
+            cleanData.append((text[start + len(INT_TOKEN):name_end], text[scanf + len(SSCANF_TOKEN) - 1:close]))
+            pos = close + 1
+        elif end >= 0:
+            cleanData.append((text[start + len(INT_TOKEN):name_end], ''))
+            pos = end + len(END_TOKEN)
+        else:
+            break
+    return cleanData
+
+
 def data_cleaner_dict(listCMD, listPARAM):
     """Return a list of tuples, that contains {function name , name of the args, type of arg, number of args}
 
@@ -83,27 +157,103 @@ def data_cleaner_dict(listCMD, listPARAM):
         else:
             pass
 
-    for i in toRemove:
-        listCMD.remove(i)
+    # Same as removing each element of toRemove, without searching the list each time
+    toRemove = set(id(i) for i in toRemove)
+    listCMD[:] = [i for i in listCMD if id(i) not in toRemove]
     return listCMD
 
 
-def data_clean(files_path):
+def data_clean(files_path, cache_file=CACHE_FILE):
     """takes a directory and converts all the contents of it designed files (.c) to a list of tuples with all the data
 
                 Keyword arguments:
 
                 directory -- the path where this function will look for .c files
+                cache_file -- file to cache the results of each .c file (see files_extract), None to not use it
 
                 """
-    TXT=files_to_string(files_path)
-
-    a = data_cleaner_cmd(TXT)
-    b = data_cleaner_param(TXT)
+    if cache_file is None:
+        TXT = files_to_string(files_path)
+        a = data_cleaner_cmd(TXT)
+        b = data_cleaner_param(TXT)
+    else:
+        a, b = files_extract(files_path, cache_file)
     clean_data = data_cleaner_dict(a, b)
     return clean_data
 
 
+def file_extract(text):
+    """Return the results of data_cleaner_cmd and data_cleaner_param for a single file, using the linear extractors
+
+            Keyword arguments:
+
+            text -- the contents of a .c file
+
+            """
+    return tokenize_cmd(text), tokenize_param(text)
+
+
+def load_cache(cache_file):
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, cache_file):
+    # Write and rename, so an interrupted build never leaves a broken cache
+    with open(cache_file + ".tmp", 'w') as f:
+        json.dump(cache, f)
+    os.replace(cache_file + ".tmp", cache_file)
+
+
+def files_extract(directory, cache_file=CACHE_FILE):
+    """takes a directory and returns the results of data_cleaner_cmd and data_cleaner_param for all its .c files,
+    the same as running them over files_to_string. The results of each file are saved in the cache file with the
+    file modification time, size and hash, so only new or changed files are parsed again.
+
+            Keyword arguments:
+
+            directory -- the path where this function will look for .c files
+            cache_file -- the json file with the results of each file
+
+            """
+    cache = load_cache(cache_file)
+    prefix = os.path.abspath(directory) + os.sep
+    # Entries of this directory that are not found again are deleted files
+    stale = set(key for key in cache if key.startswith(prefix) and os.sep not in key[len(prefix):])
+    changed = False
+    cmds = []
+    params = []
+    for filename in os.listdir(directory):
+        if not filename.endswith(".c"):
+            continue
+        location = directory + "/" + filename
+        key = prefix + filename
+        stale.discard(key)
+        stat = os.stat(location)
+        entry = cache.get(key)
+        if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            with open(location, 'r') as actual_file:
+                text = actual_file.read()
+            digest = hashlib.sha1(text.encode()).hexdigest()
+            if entry is None or entry["sha1"] != digest:
+                cmd, param = file_extract(text)
+                entry = {"sha1": digest, "cmd": cmd, "param": param}
+            entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+            cache[key] = entry
+            changed = True
+        cmds.extend(tuple(x) for x in entry["cmd"])
+        params.extend(tuple(x) for x in entry["param"])
+
+    for key in stale:
+        del cache[key]
+    if changed or stale:
+        save_cache(cache, cache_file)
+    return cmds, params
+
+
 def files_to_string(directory):
     """takes a directory and converts all the contents of it designed files (.c) to a single string
 
@@ -116,8 +266,8 @@ def files_to_string(directory):
     for filename in os.listdir(directory):
         if filename.endswith(".c"):
             location = directory + "/" + filename
-            actualFile = open(location, 'r')
-            TXT.append(actualFile.read())
+            with open(location, 'r') as actualFile:
+                TXT.append(actualFile.read())
             continue
         else:
             continue
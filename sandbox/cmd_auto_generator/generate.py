@@ -0,0 +1,159 @@
+import os
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import data_cleaner as DC
+import auto_cmd
+import auto_tm
+import get_cmd_list
+
+# Headers with the telemetry structs, see auto_tm.file_to_text
+TM_FILES = ("repoDataSchema.h",)
+
+
+def find_sources(roots):
+    """Return the .c files and telemetry headers found walking each root recursively, as absolute paths
+    in a fixed order (roots in the given order, then directories and files sorted by name)
+
+            Keyword arguments:
+
+            roots -- a list of source directories, eg. src/system and src/drivers
+
+            """
+    sources = []
+    for root in roots:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.endswith(".c") or filename in TM_FILES:
+                    sources.append(os.path.abspath(os.path.join(directory, filename)))
+    # Roots can overlap
+    return list(dict.fromkeys(sources))
+
+
+def parse_source(location, sha1=None):
+    """Read and parse a single source file: commands and parameters of a .c file (see data_cleaner.file_extract),
+    telemetry structs of a header (see auto_tm.get_functions). Runs in the worker processes.
+
+            Keyword arguments:
+
+            location -- the path of the file
+            sha1 -- the hash of the cached results, if the contents did not change they are not parsed again
+
+            """
+    with open(location, 'r') as actual_file:
+        text = actual_file.read()
+    digest = hashlib.sha1(text.encode()).hexdigest()
+    if digest == sha1:
+        return {"sha1": digest}
+    if location.endswith(".c"):
+        cmd, param = DC.file_extract(text)
+        return {"sha1": digest, "cmd": cmd, "param": param}
+    return {"sha1": digest, "tm": auto_tm.get_functions(text)}
+
+
+def parse_sources(roots, cache_file=DC.CACHE_FILE, workers=None):
+    """Parse the source files of each root in a process pool, only the ones not found in the cache or that changed.
+    The cache is shared with data_cleaner.files_extract. Returns the results of each file, in the order of
+    find_sources, and the number of files parsed.
+
+            Keyword arguments:
+
+            roots -- a list of source directories
+            cache_file -- the json file with the results of each file, None to parse all the files
+            workers -- number of processes, None to use one per cpu, 1 to parse in this process
+
+            """
+    sources = find_sources(roots)
+    cache = DC.load_cache(cache_file) if cache_file is not None else {}
+    todo = []
+    for location in sources:
+        stat = os.stat(location)
+        entry = cache.get(location)
+        if entry is not None and ("cmd" if location.endswith(".c") else "tm") not in entry:
+            entry = None
+        if entry is None or entry["mtime"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            todo.append((location, stat, entry))
+
+    locations = [location for location, stat, entry in todo]
+    hashes = [entry["sha1"] if entry else None for location, stat, entry in todo]
+    if workers == 1 or len(todo) < 2:
+        results = list(map(parse_source, locations, hashes))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(parse_source, locations, hashes, chunksize=max(1, len(todo) // (4 * workers))))
+
+    for (location, stat, entry), result in zip(todo, results):
+        if entry is None or entry["sha1"] != result["sha1"]:
+            entry = result
+        entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        cache[location] = entry
+
+    if cache_file is not None:
+        # Entries under the roots that are not found again are deleted files
+        prefixes = tuple(os.path.abspath(root) + os.sep for root in roots)
+        stale = set(key for key in cache if key.startswith(prefixes)).difference(sources)
+        for key in stale:
+            del cache[key]
+        if todo or stale:
+            DC.save_cache(cache, cache_file)
+    return [cache[location] for location in sources], len(todo)
+
+
+def generate(roots, cmd_path, tlm_path, csv_path, cache_file=DC.CACHE_FILE, workers=None):
+    """Parse the source roots once and write the COSMOS cmd file (see auto_cmd), the COSMOS tlm file (see auto_tm)
+    and the csv list of commands (see get_cmd_list)
+
+            Keyword arguments:
+
+            roots -- a list of source directories, walked recursively
+            cmd_path -- the path of the cmd file, None to skip it
+            tlm_path -- the path of the tlm file, None to skip it
+            csv_path -- the path of the csv file, None to skip it
+            cache_file -- the json file with the results of each file, None to parse all the files
+            workers -- number of processes, None to use one per cpu, 1 to parse in this process
+
+            """
+    start = time.time()
+    entries, parsed = parse_sources(roots, cache_file, workers)
+    cmds = []
+    params = []
+    function_list = []
+    for entry in entries:
+        cmds.extend(tuple(x) for x in entry.get("cmd", []))
+        params.extend(tuple(x) for x in entry.get("param", []))
+        function_list.extend(tuple(x) for x in entry.get("tm", []))
+    clean_data = DC.data_cleaner_dict(cmds, params)
+
+    if cmd_path is not None:
+        auto_cmd.write_CMD(clean_data, cmd_path)
+    if tlm_path is not None:
+        auto_tm.write_TM(function_list, auto_tm.get_function_data(function_list), tlm_path)
+    if csv_path is not None:
+        get_cmd_list.write_cmd_list(clean_data, csv_path)
+    print("{} files ({} parsed), {} commands, {} telemetry structs in {:.3f} s".format(
+        len(entries), parsed, len(clean_data), len(function_list), time.time() - start))
+    return 0
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser(description="Generate the COSMOS cmd and tlm files and the csv list of commands")
+    parser.add_argument('roots', nargs='*', type=str, default=["../../src/system", "../../src/drivers"],
+                        help="Source directories, walked recursively")
+    parser.add_argument('--cmd', type=str, default="./suchai_cmds.txt", help="COSMOS cmd file, '' to skip it")
+    parser.add_argument('--tlm', type=str, default="./suchai_tlm.txt", help="COSMOS tlm file, '' to skip it")
+    parser.add_argument('--csv', type=str, default="./suchai_cmd_list.csv", help="Csv list of commands, '' to skip it")
+    parser.add_argument('-w', '--workers', type=int, help="Parser processes, one per cpu by default")
+    parser.add_argument('--no-cache', action="store_true", help="Parse all the files, without reading or writing "
+                                                                 "the cache " + DC.CACHE_FILE)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_parameters()
+    generate(args.roots, args.cmd or None, args.tlm or None, args.csv or None,
+             None if args.no_cache else DC.CACHE_FILE, args.workers)
@@ -11,6 +11,18 @@ def get_cmd_list(files_path,target_path):
 
                 """
     data_list=DC.data_clean(files_path)
+    write_cmd_list(data_list, target_path)
+
+
+def write_cmd_list(data_list, target_path):
+    """writes the commands found by data_cleaner.data_clean to a csv in the designated path
+
+                Keyword arguments:
+
+                data_list -- a list with all the information of the commands
+                target_path-- the path where the csv file will created of overwritten
+
+                """
     f=open(target_path,"w+")
     f.write("command name, number of params, params%type--> \n")
     for x in data_list:
@@ -0,0 +1,183 @@
+import re
+import struct
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from auto_tm import file_to_text, get_functions, get_function_data, get_name
+
+# Telemetry types, as in cmdTM.h
+TM_TYPE_GENERIC = 0
+TM_TYPE_STATUS = 1
+TM_TYPE_PAYLOAD = 10
+
+# Frame header as in com_frame_t (cmdCOM.h): nframe, type, ndata
+FRAME_HEADER = struct.Struct('<HHI')
+
+# C type: (struct format, numpy type). Pointers are not sent, so char* is not supported
+_TYPES = {
+    'char': ('c', 'S1'),
+    'uint16_t': ('H', 'u2'),
+    'int16_t': ('h', 'i2'),
+    'uint32_t': ('I', 'u4'),
+    'int32_t': ('i', 'i4'),
+    'int': ('i', 'i4'),
+    'float': ('f', 'f4'),
+}
+
+
+# Comments, with the spaces before them. Commented out fields are also matched by the auto_tm fields regexp
+_comments = re.compile(r"[ \t]*(?://[^\n]*|/\*.*?\*/)", flags=re.DOTALL)
+
+
+class TmType(object):
+    __slots__ = ['fr_type', 'name', 'c_name', 'fields', 'struct', 'dtype', 'record']
+
+    def __init__(self, fr_type, name, c_name, fields, byteorder='<'):
+        """
+        Telemetry type. Precompiled struct and numpy dtype of a repoDataSchema.h struct
+        :param fr_type: Int. Telemetry type id (com_frame_t type)
+        :param name: Str. Telemetry name as in auto_tm (TM_STATUS, TM_PAYLOAD_TEMP, ...)
+        :param c_name: Str. C struct name (dat_status_t, temp_data_t, ...)
+        :param fields: List. [(C type, variable name), ...]
+        :param byteorder: Str. '<' little endian (default), '>' big endian
+
+        >>> tm = TmType(10, 'TM_PAYLOAD_TEMP', 'temp_data_t', [('int', 'timestamp'), ('float', 'obc_temp_1')])
+        >>> tm.struct.format, tm.struct.size, tm.dtype.itemsize
+        ('<if', 8, 8)
+        """
+        self.fr_type = fr_type
+        self.name = name
+        self.c_name = c_name
+        self.fields = [name for _, name in fields]
+        self.struct = struct.Struct(byteorder + ''.join(_TYPES[c_type][0] for c_type, _ in fields))
+        self.dtype = np.dtype([(name, byteorder + _TYPES[c_type][1]) for c_type, name in fields])
+        self.record = namedtuple(c_name, self.fields)
+
+    def __str__(self):
+        return "{} ({}): {}, {} bytes".format(self.name, self.fr_type, self.c_name, self.struct.size)
+
+
+def get_schema(file_path="../../src/system/include", byteorder='<'):
+    """
+    Parse repoDataSchema.h (using auto_tm) and build the telemetry types.
+    The status struct is TM_TYPE_STATUS and the payload structs (*_data_t) are TM_TYPE_PAYLOAD + payload id,
+    in the same order of payload_id_t. Structs that are not sent as telemetry (fp_entry_t) are skipped.
+    :param file_path: Str. Directory containing repoDataSchema.h
+    :param byteorder: Str. '<' little endian (default), '>' big endian
+    :return: Dict. {fr_type: TmType}
+
+    Sizes match the C structs (sizeof)
+    >>> {tm.c_name: tm.struct.size for tm in get_schema().values()}
+    {'dat_status_t': 208, 'temp_data_t': 16, 'ads_data_t': 28, 'eps_data_t': 40, 'langmuir_data_t': 20}
+    """
+    file_as_string = file_to_text(file_path)
+    function_list = [(_comments.sub('', text), name) for text, name in get_functions(file_as_string)]
+    function_data = get_function_data(function_list)
+
+    schema = {}
+    payload = 0
+    for function, data in zip(function_list, function_data):
+        c_name = function[1].strip()
+        name = get_name(function[1])
+        if "STATUS" in name:
+            fr_type = TM_TYPE_STATUS
+        elif "PAYLOAD" in name:
+            fr_type = TM_TYPE_PAYLOAD + payload
+            payload += 1
+        else:
+            continue
+        fields = [(c_type, var_name.strip()) for c_type, var_name, _ in data]
+        schema[fr_type] = TmType(fr_type, name, c_name, fields, byteorder)
+    return schema
+
+
+class TmDecoder(object):
+
+    def __init__(self, schema=None):
+        """
+        Decode telemetry frames (com_frame_t) by telemetry type
+        :param schema: Dict. {fr_type: TmType}, see get_schema. None to parse the default repoDataSchema.h
+
+        >>> tm = TmType(10, 'TM_PAYLOAD_TEMP', 'temp_data_t', [('int', 'timestamp'), ('float', 'obc_temp_1')])
+        >>> decoder = TmDecoder({10: tm})
+        >>> frame = FRAME_HEADER.pack(0, 10, 2) + tm.struct.pack(1, 20.5) + tm.struct.pack(2, 21.0)
+        >>> decoder.decode(frame)
+        (0, 10, [temp_data_t(timestamp=1, obc_temp_1=20.5), temp_data_t(timestamp=2, obc_temp_1=21.0)])
+        >>> decoder.decode_array(frame)[2]['obc_temp_1'].tolist()
+        [20.5, 21.0]
+        """
+        self.schema = get_schema() if schema is None else schema
+
+    def header(self, frame):
+        """
+        Decode the frame header
+        :param frame: Bytes or buffer. Telemetry frame (CSP data)
+        :return: Tuple. (nframe, fr_type, n_samples)
+        """
+        return FRAME_HEADER.unpack_from(frame)
+
+    def _samples(self, frame):
+        nframe, fr_type, n_samples = FRAME_HEADER.unpack_from(frame)
+        tm = self.schema.get(fr_type)
+        if tm is None:
+            raise KeyError("Undefined telemetry type {}".format(fr_type))
+        # Frames are zero padded, only n_samples structs are valid
+        end = FRAME_HEADER.size + n_samples * tm.struct.size
+        if end > len(frame):
+            raise ValueError("Frame too short for {} samples of {}".format(n_samples, tm.c_name))
+        return nframe, fr_type, tm, memoryview(frame)[FRAME_HEADER.size:end]
+
+    def decode(self, frame):
+        """
+        Decode a frame into typed records
+        :param frame: Bytes or buffer. Telemetry frame (CSP data)
+        :return: Tuple. (nframe, fr_type, [namedtuple records])
+        """
+        nframe, fr_type, tm, data = self._samples(frame)
+        return nframe, fr_type, [tm.record._make(s) for s in tm.struct.iter_unpack(data)]
+
+    def decode_array(self, frame):
+        """
+        Decode a frame into a numpy structured array (no copy, the array uses the frame buffer)
+        :param frame: Bytes or buffer. Telemetry frame (CSP data)
+        :return: Tuple. (nframe, fr_type, numpy array with the telemetry type dtype)
+        """
+        nframe, fr_type, tm, data = self._samples(frame)
+        return nframe, fr_type, np.frombuffer(data, dtype=tm.dtype)
+
+    def decode_many(self, frames):
+        """
+        Decode many frames into columnar arrays, one structured array per telemetry type
+        :param frames: Iterable of bytes or buffers. Telemetry frames
+        :return: Dict. {fr_type: numpy array}. Unknown telemetry types are skipped
+        """
+        chunks = {}
+        for frame in frames:
+            try:
+                _, fr_type, samples = self.decode_array(frame)
+            except (KeyError, ValueError, struct.error):
+                continue
+            chunks.setdefault(fr_type, []).append(samples)
+        return {fr_type: np.concatenate(arrays) for fr_type, arrays in chunks.items()}
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser(description="Print or decode telemetry types from repoDataSchema.h")
+    parser.add_argument('files_path', nargs='?', type=str, default="../../src/system/include")
+    parser.add_argument('-b', '--big_endian', action="store_true", help="Frames are big endian")
+    parser.add_argument('-x', '--hex', action="append", default=[], help="Frame to decode as hex string")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_parameters()
+    tm_schema = get_schema(args.files_path, '>' if args.big_endian else '<')
+    for tm_type in tm_schema.values():
+        print(tm_type)
+    tm_decoder = TmDecoder(tm_schema)
+    for frame_hex in args.hex:
+        print(tm_decoder.decode(bytes.fromhex(frame_hex)))
@@ -0,0 +1,358 @@
+import re
+import zmq
+import time
+import struct
+import random
+import asyncio
+import argparse
+import resource
+import threading
+import tracemalloc
+import multiprocessing
+
+from zmqnode import CspZmqNode, CspHeader, FrozenCspHeader
+from zmqnode_async import AsyncCspZmqNode
+from zmqrouter import CspZmqRouterHub, CspZmqRouterNode
+
+
+def legacy_dump(prio, src_node, dst_node, dst_port, src_port, hmac=False, xtea=False, rdp=False, crc32=False):
+    """
+    Original string based header encoder, kept as reference for the benchmarks
+    :return: Bytes. Header bytes
+    """
+    #          Prio   SRC   DST    DP   SP  RES    H     X      R    C
+    header = "{:02b}{:05b}{:05b}{:06b}{:06b}0000{:01b}{:01b}{:01b}{:01b}"
+    hdr_bin = header.format(prio, src_node, dst_node, dst_port, src_port, hmac, xtea, rdp, crc32)
+    hdr_bin = re.findall("........", hdr_bin)[::-1]
+    return bytes([int(i, 2) for i in hdr_bin])
+
+
+class LegacyHeader(object):
+    """
+    Original CspHeader, with a per-instance __dict__ and the hex based decoder and string based encoder (debug
+    prints removed). Kept as reference for the benchmarks.
+    """
+    def __init__(self, src_node=None, dst_node=None, src_port=None, dst_port=None, prio=2, hdr_bytes=None):
+        self.src_node = src_node
+        self.dst_node = dst_node
+        self.src_port = src_port
+        self.dst_port = dst_port
+        self.prio = prio
+        self.hmac = False
+        self.xtea = False
+        self.rdp = False
+        self.crc32 = False
+        self.mac_node = dst_node
+        self.__bytes = None
+        if hdr_bytes:
+            self.from_bytes(hdr_bytes)
+
+    def from_bytes(self, hdr_bytes):
+        assert len(hdr_bytes) == 4
+        self.__bytes = hdr_bytes
+        hdr_int = int(bytes(reversed(hdr_bytes)).hex(), 16)
+        self.src_node = (hdr_int >> 25) & 0x1f
+        self.dst_node = (hdr_int >> 20) & 0x1f
+        self.dst_port = (hdr_int >> 14) & 0x3f
+        self.src_port = (hdr_int >> 8) & 0x3f
+        self.prio = (hdr_int >> 30) & 0x03
+        self.hmac = True if ((hdr_int >> 3) & 0x01) else False
+        self.xtea = True if ((hdr_int >> 2) & 0x01) else False
+        self.rdp = True if ((hdr_int >> 1) & 0x01) else False
+        self.crc32 = True if ((hdr_int >> 0) & 0x01) else False
+        self.mac_node = self.dst_node
+
+    def to_bytes(self):
+        self.__bytes = legacy_dump(self.prio, self.src_node, self.dst_node, self.dst_port, self.src_port,
+                                   self.hmac, self.xtea, self.rdp, self.crc32)
+        return self.__bytes
+
+
+def random_fields(n, seed=0):
+    """ Return n random (prio, src, dst, dport, sport, hmac, xtea, rdp, crc32) tuples """
+    rnd = random.Random(seed)
+    return [(rnd.randint(0, 3), rnd.randint(0, 31), rnd.randint(0, 31), rnd.randint(0, 63), rnd.randint(0, 63),
+             rnd.random() < 0.5, rnd.random() < 0.5, rnd.random() < 0.5, rnd.random() < 0.5) for _ in range(n)]
+
+
+def check_header(n):
+    """ Check the header codec against the legacy one """
+    for f in random_fields(n, seed=1):
+        hdr = CspHeader(f[1], f[2], f[4], f[3], f[0])
+        hdr.hmac, hdr.xtea, hdr.rdp, hdr.crc32 = f[5:]
+        hdr_bytes = hdr.to_bytes()
+        assert hdr_bytes == legacy_dump(*f), f
+        assert CspHeader(hdr_bytes=hdr_bytes).to_bytes() == hdr_bytes, f
+        assert LegacyHeader(hdr_bytes=hdr_bytes).to_bytes() == hdr_bytes, f
+    print("Header codec: {} headers match the legacy encoder".format(n))
+
+
+def bench_header(n):
+    """ Compare headers/s of the legacy and current encoder and decoder """
+    fields = random_fields(n)
+    # Common session tuples, as seen in a real pass
+    common = [(2, 1, 10, 10, 48 + i % 4, False, False, False, False) for i in range(n)]
+
+    t0 = time.perf_counter()
+    for f in fields:
+        hdr = LegacyHeader(f[1], f[2], f[4], f[3], f[0])
+        hdr.to_bytes()
+    t1 = time.perf_counter()
+    for f in fields:
+        hdr = CspHeader(f[1], f[2], f[4], f[3], f[0])
+        hdr.to_bytes()
+    t2 = time.perf_counter()
+    for f in common:
+        hdr = CspHeader(f[1], f[2], f[4], f[3], f[0])
+        hdr.to_bytes()
+    t3 = time.perf_counter()
+    raw = [legacy_dump(*f) for f in fields]
+    t4 = time.perf_counter()
+    for r in raw:
+        LegacyHeader(hdr_bytes=r)
+    t5 = time.perf_counter()
+    for r in raw:
+        CspHeader(hdr_bytes=r)
+    t6 = time.perf_counter()
+
+    print("Encode legacy:        {:12.0f} headers/s".format(n / (t1 - t0)))
+    print("Encode CspHeader:     {:12.0f} headers/s".format(n / (t2 - t1)))
+    print("Encode CspHeader (c): {:12.0f} headers/s".format(n / (t3 - t2)))
+    print("Decode legacy:        {:12.0f} headers/s".format(n / (t5 - t4)))
+    print("Decode CspHeader:     {:12.0f} headers/s".format(n / (t6 - t5)))
+
+
+def bench_memory(n):
+    """ Compare the memory used per header by each header class """
+    raw = [legacy_dump(*f) for f in random_fields(n)]
+    for name, cls in (("Legacy (__dict__)", lambda r: LegacyHeader(hdr_bytes=r)),
+                      ("CspHeader (__slots__)", lambda r: CspHeader(hdr_bytes=r)),
+                      ("FrozenCspHeader", FrozenCspHeader.from_bytes)):
+        tracemalloc.start()
+        headers = [cls(r) for r in raw]
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("Memory {:22} {:6.1f} bytes/header".format(name + ":", size / len(headers)))
+        del headers
+
+
+def bench_numpy(n):
+    """ Compare headers/s of the vectorized and the scalar CspHeader decoder and encoder """
+    import numpy as np
+    from csp_numpy import decode_headers, encode_headers
+
+    raw = np.random.default_rng(0).integers(0, 1 << 32, n, dtype=np.uint32) & np.uint32(0xfffff0f)
+    raw_bytes = raw.astype('<u4').tobytes()
+    sample = min(n, 1000000)
+
+    t0 = time.perf_counter()
+    headers = [CspHeader(hdr_bytes=raw_bytes[i:i + 4]) for i in range(0, sample * 4, 4)]
+    t1 = time.perf_counter()
+    decoded = decode_headers(raw_bytes)
+    t2 = time.perf_counter()
+    for hdr in headers:
+        hdr.to_bytes()
+    t3 = time.perf_counter()
+    encoded = encode_headers(decoded).tobytes()
+    t4 = time.perf_counter()
+
+    assert encoded == raw_bytes
+    for i in range(0, sample, max(1, sample // 1000)):
+        assert (headers[i].src_node, headers[i].dst_node, headers[i].dst_port, headers[i].src_port) == \
+               tuple(decoded[i][['src', 'dst', 'dport', 'sport']].tolist())
+    print("Decode CspHeader ({} headers): {:12.0f} headers/s".format(sample, sample / (t1 - t0)))
+    print("Decode numpy ({} headers):     {:12.0f} headers/s".format(n, n / (t2 - t1)))
+    print("Encode CspHeader ({} headers): {:12.0f} headers/s".format(sample, sample / (t3 - t2)))
+    print("Encode numpy ({} headers):     {:12.0f} headers/s".format(n, n / (t4 - t3)))
+
+
+def start_proxy(in_port, out_port):
+    """ Start a XSUB-XPUB proxy in a background thread, as the hub does """
+    ctx = zmq.Context.instance()
+    xsub_in = ctx.socket(zmq.XSUB)
+    xpub_out = ctx.socket(zmq.XPUB)
+    xsub_in.bind('tcp://*:{}'.format(in_port))
+    xpub_out.bind('tcp://*:{}'.format(out_port))
+    th = threading.Thread(target=zmq.proxy, args=(xsub_in, xpub_out), daemon=True)
+    th.start()
+    return th
+
+
+def print_link(name, n, received, t_start, t_end, latencies):
+    """ Print the frames/s and latency of a node link benchmark """
+    latencies = sorted(latencies) or [0]
+    print("{:10} {:7d}/{} frames {:10.0f} frames/s latency p50 {:8.1f} us p99 {:8.1f} us".format(
+        name + ":", received, n, received / (t_end - t_start), latencies[len(latencies) // 2] * 1e6,
+        latencies[int(len(latencies) * 0.99)] * 1e6))
+
+
+def bench_threaded_node(n, in_port, out_port):
+    """ Frames/s and latency between two threaded nodes """
+    latencies = []
+    t_last = [0]
+    done = threading.Event()
+
+    def read_message(msg, hdr):
+        t_last[0] = time.perf_counter()
+        latencies.append(t_last[0] - struct.unpack('d', msg[:8])[0])
+        if len(latencies) >= n:
+            done.set()
+
+    rx = CspZmqNode(10, 'localhost', out_port, in_port)
+    rx.read_message = read_message
+    tx = CspZmqNode(11, 'localhost', out_port, in_port, monitor=False, console=True, queue_size=1000)
+    rx.start()
+    tx.start()
+    time.sleep(0.5)
+
+    hdr = CspHeader(11, 10, 1, 10)
+    t_start = time.perf_counter()
+    for i in range(n):
+        tx.send_message(struct.pack('d', time.perf_counter()), hdr)
+    done.wait(10)
+    tx.stop()
+    rx.stop()
+    print_link("Threaded", n, len(latencies), t_start, t_last[0], latencies)
+
+
+def bench_async_node(n, in_port, out_port):
+    """ Frames/s and latency between two asyncio nodes """
+    latencies = []
+    t_last = [0]
+
+    async def main():
+        done = asyncio.Event()
+
+        async def read_message(msg, hdr):
+            t_last[0] = time.perf_counter()
+            latencies.append(t_last[0] - struct.unpack('d', msg[:8])[0])
+            if len(latencies) >= n:
+                done.set()
+
+        rx = AsyncCspZmqNode(10, 'localhost', out_port, in_port)
+        rx.read_message = read_message
+        tx = AsyncCspZmqNode(11, 'localhost', out_port, in_port, monitor=False, console=True)
+        await rx.start()
+        await tx.start()
+        await asyncio.sleep(0.5)
+
+        hdr = CspHeader(11, 10, 1, 10)
+        t_start = time.perf_counter()
+        for i in range(n):
+            await tx.send_message(struct.pack('d', time.perf_counter()), hdr)
+            if i % 100 == 0:
+                await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(done.wait(), 10)
+        except asyncio.TimeoutError:
+            pass
+        await tx.stop()
+        await rx.stop()
+        return t_start
+
+    t_start = asyncio.run(main())
+    print_link("Asyncio", n, len(latencies), t_start, t_last[0], latencies)
+
+
+def _run_proxy(in_port, out_port):
+    """ Hub process running a XSUB-XPUB proxy """
+    start_proxy(in_port, out_port).join()
+
+
+def bench_hub(nodes, frames, router, in_port, out_port):
+    """
+    Hub CPU time and egress bytes with a number of nodes, each node sending frames to the next one.
+    The hub runs in another process to measure its CPU time.
+    :return: Tuple. (frames received, egress bytes, hub CPU seconds)
+    """
+    if router:
+        target, args = CspZmqRouterHub(in_port, monitor=False).start, ()
+    else:
+        target, args = _run_proxy, (in_port, out_port)
+    cpu_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    hub = multiprocessing.Process(target=target, args=args)
+    hub.start()
+
+    received = [0, 0]
+    lock = threading.Lock()
+
+    def read_message(msg, hdr):
+        with lock:
+            received[0] += 1
+            received[1] += len(msg) + 5
+
+    node_list = []
+    for n in range(1, nodes + 1):
+        if router:
+            node = CspZmqRouterNode(n, 'localhost', in_port, console=True, queue_size=1000)
+        else:
+            node = CspZmqNode(n, 'localhost', out_port, in_port, console=True, queue_size=1000)
+        node.read_message = read_message
+        node.start()
+        node_list.append(node)
+    time.sleep(1)
+
+    data = b'x' * 64
+    for i in range(frames):
+        for node in node_list:
+            node.send_message(data, CspHeader(node.node, node.node % nodes + 1, 10, 10))
+
+    # Wait until all frames arrive or stop arriving
+    last = -1
+    while received[0] != last and received[0] < frames * nodes:
+        last = received[0]
+        time.sleep(0.5)
+
+    for node in node_list:
+        node.stop()
+    hub.terminate()
+    hub.join()
+    cpu_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (cpu_end.ru_utime + cpu_end.ru_stime) - (cpu_start.ru_utime + cpu_start.ru_stime)
+    return received[0], received[1], cpu
+
+
+def bench_hubs(frames, in_port, out_port):
+    """ Compare the broadcast (XSUB-XPUB) and routing (ROUTER) hubs from 2 to 32 nodes """
+    for nodes in (2, 4, 8, 16, 32):
+        for name, router in (("Broadcast", False), ("Router", True)):
+            rx, egress, cpu = bench_hub(nodes, frames, router, in_port, out_port)
+            print("Hub {:10} {:2d} nodes: {:7d}/{} frames, egress {:10d} bytes, hub CPU {:6.2f} s".format(
+                name, nodes, rx, frames * nodes, egress, cpu))
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--num", default=200000, type=int, help="Number of headers")
+    parser.add_argument("-f", "--frames", default=20000, type=int, help="Number of frames for node benchmarks")
+    parser.add_argument("-i", "--in_port", default="8102", help="Benchmark hub input port")
+    parser.add_argument("-o", "--out_port", default="8101", help="Benchmark hub output port")
+    parser.add_argument("--nodes", action="store_true", help="Run node benchmarks")
+    parser.add_argument("--hubs", action="store_true", help="Run hub scaling benchmarks")
+    parser.add_argument("--numpy", action="store_true", help="Run vectorized header benchmarks (-n headers)")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+
+    if not (args.numpy or args.nodes or args.hubs):
+        check_header(args.num)
+        bench_header(args.num)
+        bench_memory(args.num)
+
+    if args.numpy:
+        bench_numpy(args.num)
+
+    if args.nodes:
+        start_proxy(args.in_port, args.out_port)
+        bench_threaded_node(args.frames, args.in_port, args.out_port)
+        bench_async_node(args.frames, args.in_port, args.out_port)
+
+    if args.hubs:
+        bench_hubs(args.frames // 10, args.in_port, args.out_port)
@@ -0,0 +1,344 @@
+import zmq
+import mmap
+import time
+import array
+import struct
+import argparse
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from zmqnode import FrozenCspHeader
+
+# Capture file format (little endian):
+#   File header: MAGIC, wall clock time (ns) and monotonic time (ns) when the file was created
+#   Records: monotonic timestamp (ns), frame length, frame (MAC byte, CSP header and data)
+MAGIC = b'CSPCAP01'
+FILE_HEADER = struct.Struct('<8sQQ')
+RECORD_HEADER = struct.Struct('<QI')
+# Sidecar index format (little endian): INDEX_MAGIC, capture file size and number of records, followed by
+# the columns: timestamps (uint64), offsets of the frames (uint64), src, dst and dport (uint8)
+INDEX_MAGIC = b'CSPIDX01'
+INDEX_HEADER = struct.Struct('<8sQQ')
+
+
+class CaptureWriter(object):
+
+    def __init__(self, prefix, max_size=1 << 30, max_time=3600, buffer_size=1 << 20):
+        """
+        Append-only capture file writer with buffered writes and file rotation by size or time.
+        Files are named <prefix>_<date>_<time>_<n>.cap
+
+        :param prefix: Str. Path and prefix of the capture files
+        :param max_size: Int. Rotate when the file is larger than this number of bytes, 0 to disable
+        :param max_time: Int. Rotate when the file is older than this number of seconds, 0 to disable
+        :param buffer_size: Int. Write buffer size in bytes
+
+        >>> import os, tempfile
+        >>> tmp = tempfile.mkdtemp()
+        >>> with CaptureWriter(os.path.join(tmp, 'pass'), max_size=40) as cap:
+        ...     cap.write(bytes([10, 0, 93, 160, 130]) + b'hello', 1)
+        ...     cap.write(bytes([10, 0, 93, 160, 130]) + b'world', 2)
+        >>> len(cap.files)
+        2
+        """
+        self.prefix = prefix
+        self.max_size = max_size
+        self.max_time = max_time
+        self.buffer_size = buffer_size
+        self.files = []
+        self.frames = 0
+        self._file = None
+        self._size = 0
+        self._deadline = 0
+
+    def _open(self):
+        """ Close the current file and open a new one """
+        self.close()
+        path = "{}_{}_{:04d}.cap".format(self.prefix, time.strftime("%Y%m%d_%H%M%S"), len(self.files))
+        self._file = open(path, 'ab', buffering=self.buffer_size)
+        self._size = self._file.write(FILE_HEADER.pack(MAGIC, time.time_ns(), time.monotonic_ns()))
+        self._deadline = time.monotonic() + self.max_time if self.max_time else float('inf')
+        self.files.append(path)
+
+    def write(self, frame, timestamp=None):
+        """
+        Append a frame to the capture
+        :param frame: Bytes. Raw frame
+        :param timestamp: Int. Monotonic time in ns, None to use the current time
+        :return: None
+        """
+        if self._file is None or (self.max_size and self._size >= self.max_size) or \
+                time.monotonic() >= self._deadline:
+            self._open()
+        size = len(frame)
+        self._file.write(RECORD_HEADER.pack(timestamp or time.monotonic_ns(), size))
+        self._file.write(frame)
+        self._size += RECORD_HEADER.size + size
+        self.frames += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CaptureReader(object):
+
+    def __init__(self, path):
+        """
+        Memory mapped capture file reader. Uses a sidecar index (<path>.idx) with the timestamp, offset, src,
+        dst and dport of each frame to answer queries without scanning the capture. The index is created, or
+        rebuilt if the capture has grown, when the file is opened.
+
+        :param path: Str. Capture file path
+
+        >>> import os, tempfile
+        >>> from zmqnode import CspHeader
+        >>> tmp = tempfile.mkdtemp()
+        >>> with CaptureWriter(os.path.join(tmp, 'pass')) as cap:
+        ...     for i in range(10):
+        ...         hdr = CspHeader(src_node=1, dst_node=10 + i % 2, src_port=40, dst_port=22)
+        ...         cap.write(bytes([hdr.mac_node]) + hdr.to_bytes() + b'frame %d' % i, 1000 + i)
+        >>> reader = CaptureReader(cap.files[0])
+        >>> len(reader)
+        10
+        >>> [bytes(data) for t, hdr, data in reader.query(dst=10, dport=22, t0=1002, t1=1006, wall=False)]
+        [b'frame 2', b'frame 4', b'frame 6']
+        >>> reader.close()
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, self.wall_start, self.mono_start = FILE_HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("{} is not a capture file".format(path))
+        if not self._load_index():
+            self._build_index()
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _load_index(self):
+        """
+        Load the sidecar index if it matches the capture file size
+        :return: Bool. True if the index was loaded
+        """
+        try:
+            with open(self.index_path, 'rb') as f:
+                magic, size, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or size != len(self._mmap):
+                    return False
+                self.timestamps = array.array('Q', f.read(8 * count))
+                self.offsets = array.array('Q', f.read(8 * count))
+                self.src = f.read(count)
+                self.dst = f.read(count)
+                self.dport = f.read(count)
+        except (OSError, struct.error):
+            return False
+        return len(self.dport) == count
+
+    def _build_index(self):
+        """
+        Scan the capture once to build and save the sidecar index
+        :return: None
+        """
+        self.timestamps = array.array('Q')
+        self.offsets = array.array('Q')
+        src, dst, dport = bytearray(), bytearray(), bytearray()
+        offset = FILE_HEADER.size
+        end = len(self._mmap)
+        while offset + RECORD_HEADER.size <= end:
+            timestamp, size = RECORD_HEADER.unpack_from(self._mmap, offset)
+            offset += RECORD_HEADER.size
+            if offset + size > end:
+                # Truncated record, the recorder was still writing
+                break
+            if size >= 5:
+                hdr = FrozenCspHeader.from_bytes(self._view[offset + 1:offset + 5])
+                src.append(hdr.src_node)
+                dst.append(hdr.dst_node)
+                dport.append(hdr.dst_port)
+            else:
+                src.append(0xff)
+                dst.append(0xff)
+                dport.append(0xff)
+            self.timestamps.append(timestamp)
+            self.offsets.append(offset)
+            offset += size
+        self.src, self.dst, self.dport = bytes(src), bytes(dst), bytes(dport)
+
+        with open(self.index_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, end, len(self.timestamps)))
+            f.write(self.timestamps.tobytes())
+            f.write(self.offsets.tobytes())
+            f.write(self.src)
+            f.write(self.dst)
+            f.write(self.dport)
+
+    def to_monotonic(self, wall):
+        """ Convert a wall clock time (seconds) to a capture timestamp (monotonic ns) """
+        return int((wall * 1e9) - self.wall_start + self.mono_start)
+
+    def to_wall(self, timestamp):
+        """ Convert a capture timestamp (monotonic ns) to wall clock time (seconds) """
+        return (timestamp - self.mono_start + self.wall_start) / 1e9
+
+    def frame(self, i):
+        """
+        Raw frame of a record, without copying
+        :param i: Int. Record number
+        :return: memoryview. MAC byte, CSP header and data
+        """
+        offset = self.offsets[i]
+        size = RECORD_HEADER.unpack_from(self._mmap, offset - RECORD_HEADER.size)[1]
+        return self._view[offset:offset + size]
+
+    def _records(self, lo, hi, dst=None, dport=None, src=None):
+        """
+        Record numbers in [lo, hi) matching the filters, comparing only that range of the index columns
+        :param lo: Int. First record
+        :param hi: Int. Last record (excluded)
+        :param dst: Int. Destination node, None for any
+        :param dport: Int. Destination port, None for any
+        :param src: Int. Source node, None for any
+        :return: List. Sorted record numbers
+        """
+        if hi <= lo:
+            return []
+        match = np.ones(hi - lo, dtype=bool)
+        for column, value in ((self.dst, dst), (self.dport, dport), (self.src, src)):
+            if value is not None:
+                match &= np.frombuffer(column, dtype=np.uint8, count=hi - lo, offset=lo) == value
+        return (np.flatnonzero(match) + lo).tolist()
+
+    def query(self, dst=None, dport=None, src=None, t0=None, t1=None, wall=True):
+        """
+        Iterate the frames matching the filters, in capture order. Time range limits are found with a binary
+        search in the index timestamps, then the filters are applied to that range of the index columns.
+
+        :param dst: Int. Destination node, None for any
+        :param dport: Int. Destination port, None for any
+        :param src: Int. Source node, None for any
+        :param t0: Float. Start time (included), None from the beginning
+        :param t1: Float. End time (included), None until the end
+        :param wall: Bool. t0, t1 and the returned times are wall clock seconds, else capture timestamps (ns)
+        :return: Iterator of (time, FrozenCspHeader, data memoryview) tuples. The header mac_node is the
+            recorded MAC byte
+        """
+        ts = self.timestamps
+        lo = 0 if t0 is None else bisect_left(ts, self.to_monotonic(t0) if wall else t0)
+        hi = len(ts) if t1 is None else bisect_right(ts, self.to_monotonic(t1) if wall else t1)
+        if dst is None and dport is None and src is None:
+            records = range(lo, hi)
+        else:
+            records = self._records(lo, hi, dst, dport, src)
+
+        for i in records:
+            frame = self.frame(i)
+            hdr = FrozenCspHeader.from_bytes(frame[1:5], frame[0]) if len(frame) >= 5 else None
+            yield (self.to_wall(ts[i]) if wall else ts[i]), hdr, frame[5:]
+
+    def close(self):
+        """ Close the capture. Frames returned by query or frame must not be in use """
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def record(prefix, port="8003", ip="localhost", max_size=1 << 30, max_time=3600, duration=0):
+    """
+    Record all frames published in the hub monitor socket (blocking)
+    :param prefix: Str. Path and prefix of the capture files
+    :param port: Str. Hub monitor port
+    :param ip: Str. Hub IP address
+    :param max_size: Int. Rotate files larger than this number of bytes
+    :param max_time: Int. Rotate files older than this number of seconds
+    :param duration: Int. Seconds to record, 0 to record until interrupted
+    :return: Int. Number of frames recorded
+    """
+    ctx = zmq.Context(1)
+    sock = ctx.socket(zmq.SUB)
+    # Queue frames in the socket while writing to disk instead of dropping them
+    sock.setsockopt(zmq.RCVHWM, 1000000)
+    sock.setsockopt(zmq.RCVBUF, 1 << 24)
+    sock.setsockopt(zmq.SUBSCRIBE, b'')
+    sock.connect('tcp://{}:{}'.format(ip, port))
+    end = time.monotonic() + duration if duration else float('inf')
+    print("Recorder started!")
+
+    with CaptureWriter(prefix, max_size, max_time) as cap:
+        try:
+            while time.monotonic() < end:
+                if not sock.poll(1000):
+                    cap.flush()
+                    continue
+                # Drain queued frames
+                for _ in range(10000):
+                    try:
+                        frame = sock.recv(zmq.NOBLOCK)
+                    except zmq.error.Again:
+                        break
+                    cap.write(frame)
+        except KeyboardInterrupt:
+            pass
+
+    sock.close(linger=0)
+    ctx.term()
+    print("Recorder stopped! {} frames in {} files".format(cap.frames, len(cap.files)))
+    return cap.frames
+
+
+def print_frames(frames):
+    """ Print the frames returned by CaptureReader.query """
+    for t, hdr, data in frames:
+        print("{:.6f} {} {}".format(t, hdr, bytes(data)))
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="Record the hub monitor socket")
+    rec.add_argument("prefix", help="Capture files path and prefix")
+    rec.add_argument("-d", "--ip", default="localhost", help="Hub IP address")
+    rec.add_argument("-m", "--mon_port", default="8003", help="Hub monitor port")
+    rec.add_argument("--max_size", default=1 << 30, type=int, help="Rotate files larger than this (bytes)")
+    rec.add_argument("--max_time", default=3600, type=int, help="Rotate files older than this (seconds)")
+    rec.add_argument("-t", "--time", default=0, type=int, help="Seconds to record, 0 until interrupted")
+
+    query = commands.add_parser("query", help="Print the frames of capture files matching the filters")
+    query.add_argument("files", nargs="+", help="Capture files")
+    query.add_argument("--src", type=int, default=None, help="Source node")
+    query.add_argument("--dst", type=int, default=None, help="Destination node")
+    query.add_argument("--dport", type=int, default=None, help="Destination port")
+    query.add_argument("--t0", type=float, default=None, help="Start time (unix time, seconds)")
+    query.add_argument("--t1", type=float, default=None, help="End time (unix time, seconds)")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+
+    if args.command == "record":
+        record(args.prefix, args.mon_port, args.ip, args.max_size, args.max_time, args.time)
+    else:
+        for path in args.files:
+            reader = CaptureReader(path)
+            print_frames(reader.query(args.dst, args.dport, args.src, args.t0, args.t1))
+            reader.close()
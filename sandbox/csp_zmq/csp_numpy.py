@@ -0,0 +1,61 @@
+import numpy as np
+
+# Decoded CSP headers, one field per column
+HEADER_DTYPE = np.dtype([('prio', 'u1'), ('src', 'u1'), ('dst', 'u1'), ('dport', 'u1'), ('sport', 'u1'),
+                         ('hmac', '?'), ('xtea', '?'), ('rdp', '?'), ('crc32', '?')])
+
+# Field: (shift, mask), as in CspHeader
+_FIELDS = (('prio', 30, 0x03), ('src', 25, 0x1f), ('dst', 20, 0x1f), ('dport', 14, 0x3f), ('sport', 8, 0x3f),
+           ('hmac', 3, 0x01), ('xtea', 2, 0x01), ('rdp', 1, 0x01), ('crc32', 0, 0x01))
+
+
+def decode_headers(headers):
+    """
+    Decode many CSP headers at once
+    :param headers: Bytes, buffer or array. Contiguous 4 bytes headers (as sent, little endian), or an
+        array of uint32 headers
+    :return: Numpy structured array with HEADER_DTYPE fields
+
+    >>> hdr = decode_headers(bytes([0, 93, 160, 130]) * 2)
+    >>> hdr['dst'].tolist(), hdr['dport'].tolist(), hdr['hmac'].tolist()
+    ([10, 10], [1, 1], [False, False])
+    """
+    if not isinstance(headers, np.ndarray):
+        headers = np.frombuffer(headers, dtype='<u4')
+    headers = headers.astype(np.uint32, copy=False)
+    decoded = np.empty(len(headers), dtype=HEADER_DTYPE)
+    for name, shift, mask in _FIELDS:
+        decoded[name] = (headers >> np.uint32(shift)) & np.uint32(mask)
+    return decoded
+
+
+def decode_columns(headers):
+    """
+    Decode many CSP headers at once into separated columns
+    :param headers: Bytes, buffer or array. See decode_headers
+    :return: Dict. {field: numpy array}
+    """
+    if not isinstance(headers, np.ndarray):
+        headers = np.frombuffer(headers, dtype='<u4')
+    headers = headers.astype(np.uint32, copy=False)
+    columns = {}
+    for name, shift, mask in _FIELDS:
+        column = (headers >> np.uint32(shift)) & np.uint32(mask)
+        columns[name] = column.astype(np.bool_ if mask == 1 else np.uint8)
+    return columns
+
+
+def encode_headers(decoded):
+    """
+    Encode many CSP headers at once
+    :param decoded: Numpy structured array with HEADER_DTYPE fields, or dict of columns
+    :return: Numpy uint32 array (little endian), use .tobytes() to get the headers as sent
+
+    >>> encode_headers(decode_headers(bytes([0, 93, 160, 130]))).tobytes()
+    b'\\x00]\\xa0\\x82'
+    """
+    headers = None
+    for name, shift, mask in _FIELDS:
+        field = (np.asarray(decoded[name]).astype(np.uint32) & np.uint32(mask)) << np.uint32(shift)
+        headers = field if headers is None else headers | field
+    return headers.astype('<u4', copy=False)
@@ -0,0 +1,154 @@
+import zmq
+import time
+import argparse
+
+from zmqnode import CspZmqNode
+from capture import CaptureReader
+
+# Frames sent later than this after their scheduled time are counted as late
+LATE_MS = 1.0
+
+
+class CspZmqReplay(CspZmqNode):
+
+    def __init__(self, hub_ip='localhost', out_port="8002", speed=1.0, remap=None, ports=None, queue_size=1000):
+        """
+        CSP ZMQ REPLAY
+        Re-inject recorded frames into a hub keeping the recorded inter-frame timing, scaled by speed.
+        Node addresses can be remapped and frames filtered by destination port.
+
+        :param hub_ip: Str. Hub IP address
+        :param out_port: Str. Output port, PUB socket. (Should match hub input port, XSUB sockets)
+        :param speed: Float. Replay speed, 1 for real time, N for N times faster, 0 for max speed
+        :param remap: Dict. Node addresses to replace {old: new}, applied to src, dst and MAC (the recorded MAC
+            byte, see CaptureReader.query)
+        :param ports: List. Destination ports to replay, None for all
+        :param queue_size: Int. Max frames waiting to be sent
+
+        >>> rp = CspZmqReplay(remap={1: 4})
+        >>> from zmqnode import FrozenCspHeader
+        >>> str(rp.remap_header(FrozenCspHeader(2, 1, 10, 22, 40, False, False, False, False, 10)))
+        'S 4, D 10, Dp 22, Sp 40, Pr 2, HMAC False XTEA False RDP False CRC32 False'
+        """
+        CspZmqNode.__init__(self, None, hub_ip, None, out_port, monitor=False, console=True, queue_size=queue_size)
+        self.speed = speed
+        self.remap = remap or {}
+        self.ports = set(ports) if ports else None
+
+    def _writer_socket(self, ctx, port, ip):
+        """
+        Create a PUB socket that blocks at the high water mark instead of dropping frames, so frames are not
+        lost when replaying faster than the hub can take them
+        :return: ZMQ socket.
+        """
+        sock = ctx.socket(zmq.PUB)
+        sock.setsockopt(zmq.XPUB_NODROP, 1)
+        sock.connect('tcp://{}:{}'.format(ip, port))
+        return sock
+
+    def remap_header(self, header):
+        """
+        Replace the node addresses of a header, as CspHeader.resend swaps them
+        :param header: FrozenCspHeader.
+        :return: FrozenCspHeader. Header with new addresses
+        """
+        if not self.remap:
+            return header
+        return header._replace(src_node=self.remap.get(header.src_node, header.src_node),
+                               dst_node=self.remap.get(header.dst_node, header.dst_node),
+                               mac_node=self.remap.get(header.mac_node, header.mac_node))
+
+    def replay(self, frames):
+        """
+        Send the frames keeping their timing (blocking), and wait until the writer has sent them. The node must
+        be started.
+        :param frames: Iterator of (timestamp ns, FrozenCspHeader, data) as CaptureReader.query(wall=False)
+        :return: Dict. Replay report: frames sent by the writer and filtered, frames queued more than LATE_MS
+            after their scheduled time, send_message calls that waited for a full queue, requested and achieved
+            (sent by the writer) rates in frames/s and timing jitter (ms)
+
+        >>> from zmqnode import FrozenCspHeader
+        >>> hdr = FrozenCspHeader(2, 1, 10, 22, 40, False, False, False, False, 10)
+        >>> rp = CspZmqReplay(speed=1000)
+        >>> rp.start(); report = rp.replay([(i * 10**9, hdr, b'x') for i in range(3)]); rp.stop()
+        Writer started!
+        Writer stopped!
+        >>> report['sent'], report['requested_rate'], report['queue_full']
+        (3, 1000.0, 0)
+        """
+        queued = filtered = late = 0
+        sent = self.sent
+        queue_full = self.queue_full
+        jitter = []
+        first_ts = last_ts = None
+        start = time.perf_counter()
+        for timestamp, header, data in frames:
+            if header is None or (self.ports is not None and header.dst_port not in self.ports):
+                filtered += 1
+                continue
+            if first_ts is None:
+                first_ts = timestamp
+            last_ts = timestamp
+            if self.speed:
+                target = start + (timestamp - first_ts) / 1e9 / self.speed
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                jitter.append(time.perf_counter() - target)
+                if jitter[-1] * 1e3 > LATE_MS:
+                    late += 1
+            # bytes() keeps the frame valid after the capture is closed
+            self.send_message(bytes(data), self.remap_header(header))
+            queued += 1
+
+        self.flush()
+        elapsed = time.perf_counter() - start
+        sent = self.sent - sent
+        # N frames span N-1 intervals
+        duration = (last_ts - first_ts) / 1e9 if queued > 1 else 0
+        jitter.sort()
+        return {
+            "sent": sent,
+            "filtered": filtered,
+            "late": late,
+            "queue_full": self.queue_full - queue_full,
+            "requested_rate": (queued - 1) / duration * self.speed if self.speed and duration else None,
+            "achieved_rate": (sent - 1) / elapsed if sent > 1 else None,
+            "jitter_mean_ms": sum(jitter) / len(jitter) * 1e3 if jitter else None,
+            "jitter_p99_ms": jitter[int(len(jitter) * 0.99)] * 1e3 if jitter else None,
+            "jitter_max_ms": jitter[-1] * 1e3 if jitter else None,
+        }
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("files", nargs="+", help="Capture files")
+    parser.add_argument("-d", "--ip", default="localhost", help="Hub IP address")
+    parser.add_argument("-o", "--out_port", default="8002", help="Hub input port")
+    parser.add_argument("-s", "--speed", default=1.0, type=float, help="Replay speed, 0 for max speed")
+    parser.add_argument("-r", "--remap", action="append", default=[], help="Node remap old:new, can be repeated")
+    parser.add_argument("-p", "--port", action="append", type=int, default=None, help="Destination port to replay")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+
+    remap = dict(tuple(int(n) for n in r.split(":")) for r in args.remap)
+    node = CspZmqReplay(args.ip, args.out_port, args.speed, remap, args.port)
+    node.start()
+    # Let the PUB socket connect before sending
+    time.sleep(1)
+    try:
+        for path in args.files:
+            reader = CaptureReader(path)
+            print(path, node.replay(reader.query(wall=False)))
+            reader.close()
+    except KeyboardInterrupt:
+        pass
+    node.stop()
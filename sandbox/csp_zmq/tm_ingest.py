@@ -0,0 +1,299 @@
+import os
+import sys
+import glob
+import time
+import struct
+import argparse
+from queue import Queue, Empty
+from threading import Lock
+
+import numpy as np
+
+from zmqnode import CspZmqNode, threaded
+
+sys.path.append("../cmd_auto_generator")
+from tm_schema import TmDecoder
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ColumnBuffer(object):
+
+    def __init__(self, tm, chunk_size=4096):
+        """
+        Fixed size column buffer for the samples of one telemetry type. Each sample keeps the telemetry
+        fields plus the ground reception time and the source node.
+        :param tm: TmType. Telemetry type
+        :param chunk_size: Int. Samples per chunk
+
+        >>> import sys; sys.path.append("../cmd_auto_generator")
+        >>> from tm_schema import TmType
+        >>> tm = TmType(10, 'TM_PAYLOAD_TEMP', 'temp_data_t', [('int', 'timestamp'), ('float', 'obc_temp_1')])
+        >>> buf = ColumnBuffer(tm, chunk_size=3)
+        >>> samples = np.array([(1, 20.5), (2, 21.0)], dtype=tm.dtype)
+        >>> buf.append(samples, 0.0, 1), len(buf)
+        ([], 2)
+        >>> [chunk['timestamp'].tolist() for chunk in buf.append(samples, 0.0, 1)], len(buf)
+        ([[1, 2, 1]], 1)
+        """
+        self.tm = tm
+        self.size = chunk_size
+        self.dtype = np.dtype(tm.dtype.descr + [('rx_time', '<f8'), ('node', 'u1')])
+        self.data = np.empty(chunk_size, dtype=self.dtype)
+        self.count = 0
+        self.first_time = None
+
+    def __len__(self):
+        return self.count
+
+    def append(self, samples, rx_time, node):
+        """
+        Copy samples into the buffer
+        :param samples: Numpy array. Samples with the telemetry type dtype
+        :param rx_time: Float. Reception unix time
+        :param node: Int. Source node
+        :return: List. Full chunks (numpy arrays), to be flushed
+        """
+        full = []
+        i = 0
+        while i < len(samples):
+            n = min(len(samples) - i, self.size - self.count)
+            dst = self.data[self.count:self.count + n]
+            for name in samples.dtype.names:
+                dst[name] = samples[name][i:i + n]
+            dst['rx_time'] = rx_time
+            dst['node'] = node
+            if self.first_time is None:
+                self.first_time = rx_time
+            self.count += n
+            i += n
+            if self.count == self.size:
+                full.append(self.take())
+        return full
+
+    def take(self):
+        """
+        Return the buffered samples and start a new chunk
+        :return: Numpy array.
+        """
+        data = self.data[:self.count]
+        self.data = np.empty(self.size, dtype=self.dtype)
+        self.count = 0
+        self.first_time = None
+        return data
+
+
+class TmIngestor(CspZmqNode):
+
+    def __init__(self, node, path="tm_data", hub_ip='localhost', in_port="8001", port=9, schema=None,
+                 chunk_size=4096, fmt="npy", max_pending=8, flush_time=60):
+        """
+        TELEMETRY INGESTOR
+        Receives telemetry frames (com_frame_t) sent to a node and port, decodes them by telemetry type and
+        stores the samples in chunk files, one directory per telemetry type:
+            <path>/<struct name>/<struct name>_<date>_<time>_<n>.npy (or .parquet)
+        Samples are accumulated in one ColumnBuffer per type. Full buffers are written by a background thread,
+        partial buffers are written after flush_time seconds. At most max_pending chunks wait to be written,
+        then the reader blocks, so memory is bounded to (types + max_pending) chunks.
+
+        :param node: Int. Ground node address (telemetry destination), None for all nodes
+        :param path: Str. Output directory
+        :param hub_ip: Str. Hub node IP address
+        :param in_port: Str. Input port, SUB socket. (Should match hub output port, XPUB sockets)
+        :param port: Int. Telemetry CSP port (SCH_TRX_PORT_TM)
+        :param schema: Dict. {fr_type: TmType}, see tm_schema.get_schema. None to parse repoDataSchema.h
+        :param chunk_size: Int. Samples per chunk file
+        :param fmt: Str. Chunk format "npy" or "parquet" (requires pyarrow)
+        :param max_pending: Int. Max chunks waiting to be written
+        :param flush_time: Float. Max seconds samples stay in memory
+        """
+        CspZmqNode.__init__(self, node, hub_ip, in_port, monitor=True, console=False)
+        if fmt == "parquet" and pyarrow is None:
+            raise ValueError("pyarrow is required to write parquet files")
+        self.path = path
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.flush_time = flush_time
+        self.decoder = TmDecoder(schema)
+        self.frames = 0
+        self.samples = 0
+        self.errors = 0
+        self.chunks = 0
+        self._buffers = {}
+        self._lock = Lock()
+        self._pending = Queue(max_pending)
+        self._flusher_th = None
+        self._name = time.strftime("%Y%m%d_%H%M%S")
+        self._seq = {}
+        self.route(port)(self.ingest)
+
+    def read_message(self, message, header=None):
+        """ Messages to other ports are ignored """
+        pass
+
+    def ingest(self, message, header=None):
+        """
+        Decode a telemetry frame and buffer its samples. Called by the reader thread.
+        :param message: Bytes or memoryview. Telemetry frame
+        :param header: CspHeader. CSP header
+        :return: None
+
+        Invalid frames are counted as errors and do not stop the ingestion
+        >>> from zmqnode import CspHeader
+        >>> from tm_schema import TmType, FRAME_HEADER
+        >>> tm = TmType(10, 'TM_PAYLOAD_TEMP', 'temp_data_t', [('int', 'timestamp'), ('float', 'obc_temp_1')])
+        >>> ingestor = TmIngestor(10, schema={10: tm})
+        >>> header = CspHeader(1, 10, 20, 9).to_bytes()
+        >>> ingestor._read_frame(bytes([10]) + header + b'abc')  # doctest: +ELLIPSIS
+        Ingest error: unpack_from requires a buffer of at least 8 bytes...
+        >>> ingestor._read_frame(bytes([10]) + header + FRAME_HEADER.pack(0, 10, 1) + tm.struct.pack(1, 20.5))
+        >>> ingestor.errors, ingestor.frames, ingestor.samples
+        (1, 1, 1)
+        """
+        try:
+            _, fr_type, samples = self.decoder.decode_array(message)
+        except (KeyError, ValueError, struct.error) as e:
+            self.errors += 1
+            print("Ingest error:", e)
+            return
+
+        with self._lock:
+            buffer = self._buffers.get(fr_type)
+            if buffer is None:
+                buffer = self._buffers[fr_type] = ColumnBuffer(self.decoder.schema[fr_type], self.chunk_size)
+            full = buffer.append(samples, time.time(), header.src_node if header else 0)
+        self.frames += 1
+        self.samples += len(samples)
+        for chunk in full:
+            self._pending.put((buffer.tm, chunk))
+
+    def _take(self, age=0):
+        """
+        Take the partial buffers to be written
+        :param age: Float. Only take buffers with samples older than age seconds
+        :return: List. [(TmType, chunk), ...]
+        """
+        now = time.time()
+        with self._lock:
+            return [(buf.tm, buf.take()) for buf in self._buffers.values()
+                    if len(buf) and now - buf.first_time >= age]
+
+    def write_chunk(self, tm, chunk):
+        """
+        Write a chunk file
+        :param tm: TmType. Telemetry type
+        :param chunk: Numpy array. Samples
+        :return: Str. File path
+        """
+        directory = os.path.join(self.path, tm.c_name)
+        os.makedirs(directory, exist_ok=True)
+        seq = self._seq.get(tm.fr_type, 0)
+        self._seq[tm.fr_type] = seq + 1
+        path = os.path.join(directory, "{}_{}_{}.{}".format(tm.c_name, self._name, seq, self.fmt))
+        if self.fmt == "parquet":
+            table = pyarrow.table({name: chunk[name] for name in chunk.dtype.names})
+            pyarrow.parquet.write_table(table, path)
+        else:
+            np.save(path, chunk)
+        self.chunks += 1
+        return path
+
+    @threaded
+    def _flusher(self):
+        """
+        Thread to write chunks. Also flushes partial buffers older than flush_time, checked every second.
+        :return: None
+        """
+        print("Flusher started!")
+        next_check = time.time() + 1
+        while True:
+            try:
+                item = self._pending.get(timeout=max(next_check - time.time(), 0))
+            except Empty:
+                items = []
+            else:
+                if item is None:
+                    break
+                items = [item]
+            # Also while full chunks keep arriving, a busy type must not hold back the others
+            if time.time() >= next_check:
+                next_check = time.time() + 1
+                # Written here, not queued, the queue may be full again
+                items += self._take(self.flush_time)
+            for tm, chunk in items:
+                try:
+                    self.write_chunk(tm, chunk)
+                except OSError as e:
+                    print("Flusher error:", e)
+        print("Flusher stopped!")
+
+    def start(self):
+        self._flusher_th = self._flusher()
+        CspZmqNode.start(self)
+
+    def stop(self):
+        CspZmqNode.stop(self)
+        self._pending.put(None)
+        self._flusher_th.join()
+        for tm, chunk in self._take():
+            self.write_chunk(tm, chunk)
+
+
+def load_chunks(path, name):
+    """
+    Load all the chunks of a telemetry type
+    :param path: Str. Ingestor output directory
+    :param name: Str. Telemetry struct name (eps_data_t, dat_status_t, ...)
+    :return: Numpy array. All samples, sorted by reception time. None if there are no chunks
+
+    Load some columns of a telemetry type
+    >>> data = load_chunks("tm_data", "eps_data_t")  # doctest: +SKIP
+    >>> data['rx_time'], data['vbatt']  # doctest: +SKIP
+    """
+    files = sorted(glob.glob(os.path.join(path, name, "*.npy")))
+    if files:
+        data = np.concatenate([np.load(f, mmap_mode='r') for f in files])
+    else:
+        files = sorted(glob.glob(os.path.join(path, name, "*.parquet")))
+        if not files or pyarrow is None:
+            return None
+        table = pyarrow.concat_tables([pyarrow.parquet.read_table(f) for f in files])
+        data = np.rec.fromarrays([table[c].to_numpy() for c in table.column_names], names=table.column_names)
+    return data[np.argsort(data['rx_time'], kind='stable')]
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--node", default=10, type=int, help="Ground node address")
+    parser.add_argument("-d", "--ip", default="localhost", help="Hub IP address")
+    parser.add_argument("-i", "--in_port", default="8001", help="Input port")
+    parser.add_argument("-p", "--port", default=9, type=int, help="Telemetry CSP port")
+    parser.add_argument("-o", "--path", default="tm_data", help="Output directory")
+    parser.add_argument("-c", "--chunk_size", default=4096, type=int, help="Samples per chunk file")
+    parser.add_argument("-f", "--fmt", default="npy", choices=["npy", "parquet"], help="Chunk file format")
+    parser.add_argument("-t", "--flush_time", default=60, type=float, help="Max seconds samples stay in memory")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+
+    ingestor = TmIngestor(args.node, args.path, args.ip, args.in_port, args.port, chunk_size=args.chunk_size,
+                          fmt=args.fmt, flush_time=args.flush_time)
+    ingestor.start()
+    try:
+        while True:
+            time.sleep(10)
+            print("Frames: {}, samples: {}, errors: {}, chunks: {}".format(
+                ingestor.frames, ingestor.samples, ingestor.errors, ingestor.chunks))
+    except KeyboardInterrupt:
+        ingestor.stop()
@@ -0,0 +1,350 @@
+import io
+import os
+import time
+import uuid
+import argparse
+from threading import Lock, Event
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psycopg2
+import psycopg2.pool
+
+from zmqnode import threaded
+
+# Binary COPY format: signature, flags and header extension length
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + bytes(8)
+COPY_TRAILER = b'\xff\xff'
+
+# Postgres type: binary representation (network byte order)
+PG_TYPES = {
+    'smallint': '>i2',
+    'integer': '>i4',
+    'bigint': '>i8',
+    'real': '>f4',
+    'double precision': '>f8',
+    'timestamp with time zone': '>i8',
+}
+
+# Numpy kind: Postgres type, to create the tables as storage_table_repo_init
+SQL_TYPES = {'f': 'REAL', 'i': 'INTEGER', 'u': 'BIGINT'}
+
+# Timestamps are sent as microseconds since 2000-01-01 UTC
+PG_EPOCH = 946684800
+
+
+def copy_binary(columns, types):
+    """
+    Encode rows in the COPY binary format, without NULL values
+    :param columns: List. Numpy arrays (or scalars), one per column, all with the same length
+    :param types: List. Postgres types of each column, see PG_TYPES
+    :return: Bytes. COPY data, header and trailer included
+
+    >>> data = copy_binary([np.array([1, 2]), np.array([0.5, 1.0])], ['integer', 'real'])
+    >>> data[:11], data[19:21], data[21:25], data[25:29]
+    (b'PGCOPY\\n\\xff\\r\\n\\x00', b'\\x00\\x02', b'\\x00\\x00\\x00\\x04', b'\\x00\\x00\\x00\\x01')
+    >>> len(data) == 19 + 2 * (2 + 8 + 8) + 2
+    True
+    """
+    fields = [('n', '>i2')]
+    for i, pg_type in enumerate(types):
+        fields += [('l{}'.format(i), '>i4'), ('v{}'.format(i), PG_TYPES[pg_type])]
+    rows = np.empty(len(columns[0]), dtype=np.dtype(fields))
+    rows['n'] = len(types)
+    for i, (column, pg_type) in enumerate(zip(columns, types)):
+        rows['l{}'.format(i)] = np.dtype(PG_TYPES[pg_type]).itemsize
+        rows['v{}'.format(i)] = column
+    return COPY_HEADER + rows.tobytes() + COPY_TRAILER
+
+
+class TmLoader(object):
+
+    def __init__(self, dsn, batch_size=10000, batch_time=5, pool_size=2, retries=3):
+        """
+        TELEMETRY LOADER
+        Bulk loads decoded telemetry samples into the PostgreSQL payload tables (temp_data, ads_data, ...) used
+        by the ground station storage (SCH_STORAGE_MODE 2), with COPY FROM STDIN in binary format.
+        Samples are batched per table and sent when a batch reaches batch_size rows or batch_time seconds (checked
+        by a background thread, so the last batch of a pass is sent even if no more samples are added).
+        Batches are loaded by pool_size threads, each one using a connection from a pool. A failed batch is
+        retried with a new connection; every batch is committed together with its id in the loader_batches
+        table, so a retried batch is never loaded twice.
+
+        :param dsn: Str. Connection string, ex: "user=suchai dbname=fs_db_1"
+        :param batch_size: Int. Rows per COPY, a batch is sent when it reaches this size
+        :param batch_time: Float. Max seconds rows wait to be loaded
+        :param pool_size: Int. Connections (and loader threads)
+        :param retries: Int. Max retries per batch
+        """
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        self.retries = retries
+        self.rows = 0
+        self.batches = 0
+        self.errors = 0
+        # One more connection for the caller thread (tables creation)
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size + 1, dsn)
+        self._executor = ThreadPoolExecutor(pool_size)
+        self._futures = []
+        self._tables = {}
+        self._batches = {}
+        self._lock = Lock()
+        self._closed = Event()
+        self._run(self._create_batches_table)
+        self._timer_th = self._timer()
+
+    def _run(self, fn, *args):
+        """
+        Run fn(cursor, *args) in a transaction, retrying with a new connection on connection errors
+        :return: fn return value
+        """
+        for retry in range(self.retries + 1):
+            conn = self._pool.getconn()
+            try:
+                with conn:
+                    with conn.cursor() as cur:
+                        result = fn(cur, *args)
+                self._pool.putconn(conn)
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self._pool.putconn(conn, close=True)
+                if retry == self.retries:
+                    raise
+                print("Loader retry {}: {}".format(retry + 1, e))
+                time.sleep(0.1 * 2 ** retry)
+            except Exception:
+                self._pool.putconn(conn)
+                raise
+
+    @staticmethod
+    def _create_batches_table(cur):
+        cur.execute("CREATE TABLE IF NOT EXISTS loader_batches(batch UUID PRIMARY KEY, tbl TEXT, nrows INTEGER, "
+                    "tstz TIMESTAMPTZ DEFAULT current_timestamp)")
+
+    @staticmethod
+    def _create_table(cur, table, dtype):
+        """ Create a payload table as storage_table_repo_init, and get its columns types """
+        columns = ["{} {}".format(name, SQL_TYPES[dtype[name].kind]) for name in dtype.names
+                   if name not in ('rx_time', 'node')]
+        cur.execute("CREATE TABLE IF NOT EXISTS {}(id INTEGER, tstz TIMESTAMPTZ, {})".format(
+            table, ", ".join(columns)))
+        cur.execute("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s "
+                    "ORDER BY ordinal_position", (table,))
+        columns = cur.fetchall()
+        cur.execute("SELECT coalesce(max(id) + 1, 0) FROM {}".format(table))
+        return columns, cur.fetchone()[0]
+
+    def _table(self, table, dtype):
+        """ Table columns and next id, the table is created on first use """
+        info = self._tables.get(table)
+        if info is None:
+            columns, next_id = self._run(self._create_table, table, dtype)
+            info = self._tables[table] = [columns, next_id]
+        return info
+
+    def add(self, table, samples):
+        """
+        Add samples to be loaded. Samples are split in batches of at most batch_size rows, each one loaded
+        with its own COPY
+        :param table: Str. Table name (temp_data, ads_data, eps_data, langmuir_data)
+        :param samples: Numpy structured array. Decoded samples (TmDecoder.decode_array or ColumnBuffer),
+            the reception time (rx_time field) is stored as tstz
+        :return: None
+
+        >>> from unittest import mock
+        >>> samples = np.zeros(2500, dtype=[('vbatt', '<u4'), ('rx_time', '<f8')])
+        >>> with mock.patch('psycopg2.pool.ThreadedConnectionPool'):
+        ...     loader = TmLoader("", batch_size=1000)
+        ...     loader._tables['eps_data'] = [[('id', 'integer'), ('tstz', 'timestamp with time zone'),
+        ...                                    ('vbatt', 'bigint')], 0]
+        ...     loader.add('eps_data', samples)
+        ...     loader.close()
+        >>> loader.batches, loader.rows
+        (3, 2500)
+        """
+        with self._lock:
+            info = self._table(table, samples.dtype)
+            ids = np.arange(info[1], info[1] + len(samples))
+            info[1] += len(samples)
+            chunks, n_rows, first_time = self._batches.pop(table, ([], 0, time.time()))
+            i = 0
+            while i < len(samples):
+                # Fill the pending batch up to batch_size rows
+                n = min(len(samples) - i, self.batch_size - n_rows)
+                chunks.append((ids[i:i + n], samples[i:i + n]))
+                n_rows += n
+                i += n
+                if n_rows >= self.batch_size:
+                    self._submit(table, chunks)
+                    chunks, n_rows, first_time = [], 0, time.time()
+            if chunks:
+                self._batches[table] = (chunks, n_rows, first_time)
+        self.flush(self.batch_time)
+
+    def flush(self, age=0):
+        """
+        Send the batches with rows older than age seconds
+        :param age: Float. Seconds
+        :return: None
+        """
+        now = time.time()
+        with self._lock:
+            for table in list(self._batches):
+                chunks, n_rows, first_time = self._batches[table]
+                if now - first_time >= age:
+                    self._submit(table, chunks)
+                    del self._batches[table]
+
+    @threaded
+    def _timer(self):
+        """
+        Thread to send the batches older than batch_time, runs until close
+        :return: Thread.
+        """
+        while not self._closed.wait(min(self.batch_time, 1) or 1):
+            self.flush(self.batch_time)
+
+    def _submit(self, table, chunks):
+        self._futures = [f for f in self._futures if not f.done()]
+        self._futures.append(self._executor.submit(self._load, table, chunks, uuid.uuid4()))
+
+    def _encode(self, table, chunks):
+        """ Encode a batch in COPY binary format, using the table columns order and types """
+        columns, _ = self._tables[table]
+        ids = np.concatenate([c[0] for c in chunks])
+        samples = np.concatenate([c[1] for c in chunks])
+        if 'rx_time' in samples.dtype.names:
+            tstz = ((samples['rx_time'] - PG_EPOCH) * 1e6).astype(np.int64)
+        else:
+            tstz = np.int64((time.time() - PG_EPOCH) * 1e6)
+        data = {'id': ids, 'tstz': tstz}
+        names = [name for name, _ in columns]
+        values = [data[name] if name in data else samples[name] for name in names]
+        return names, copy_binary(values, [pg_type for _, pg_type in columns]), len(ids)
+
+    def _load(self, table, chunks, batch):
+        """ Load a batch (loader thread) """
+        try:
+            names, data, n_rows = self._encode(table, chunks)
+            if self._run(self._copy, table, names, data, n_rows, batch):
+                with self._lock:
+                    self.rows += n_rows
+                    self.batches += 1
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print("Loader error:", e)
+
+    @staticmethod
+    def _copy(cur, table, names, data, n_rows, batch):
+        """ Copy a batch and register it in the same transaction. Batches already loaded are skipped """
+        cur.execute("INSERT INTO loader_batches (batch, tbl, nrows) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                    (str(batch), table, n_rows))
+        if cur.rowcount == 0:
+            return False
+        cur.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT binary)".format(table, ", ".join(names)),
+                        io.BytesIO(data))
+        return True
+
+    def insert(self, table, samples):
+        """
+        Load samples row by row with INSERT, as storage_set_payload_data. For benchmarking only.
+        :param table: Str. Table name
+        :param samples: Numpy structured array. Decoded samples
+        :return: None
+        """
+        with self._lock:
+            info = self._table(table, samples.dtype)
+            first_id = info[1]
+            info[1] += len(samples)
+        names = [name for name in samples.dtype.names if name not in ('rx_time', 'node')]
+        sql = "INSERT INTO {} (id, tstz, {}) VALUES (%s, current_timestamp, {})".format(
+            table, ", ".join(names), ", ".join(["%s"] * len(names)))
+
+        def _insert(cur):
+            for i, row in enumerate(samples[names].tolist()):
+                cur.execute(sql, (first_id + i,) + row)
+        self._run(_insert)
+        with self._lock:
+            self.rows += len(samples)
+
+    def join(self):
+        """
+        Send pending batches and wait until they are loaded
+        :return: None
+        """
+        self.flush()
+        for future in list(self._futures):
+            future.result()
+
+    def close(self):
+        self._closed.set()
+        self._timer_th.join()
+        self.join()
+        self._executor.shutdown()
+        self._pool.closeall()
+
+
+def benchmark(loader, n_rows, table="bench_eps_data"):
+    """
+    Compare COPY and row by row INSERT loading eps_data like samples
+    :param loader: TmLoader.
+    :param n_rows: Int. Rows to load with each method
+    :param table: Str. Table prefix, tables are dropped before and after the benchmark
+    :return: None
+    """
+    dtype = np.dtype([('timestamp', '<i4'), ('cursun', '<u4'), ('cursys', '<u4'), ('vbatt', '<u4')] +
+                     [('temp{}'.format(i), '<i4') for i in range(1, 7)] + [('rx_time', '<f8')])
+    samples = np.zeros(n_rows, dtype=dtype)
+    samples['timestamp'] = np.arange(n_rows)
+    samples['vbatt'] = 8000
+    samples['rx_time'] = time.time()
+
+    for method in ("copy", "insert"):
+        name = "{}_{}".format(table, method)
+        loader._run(lambda cur: cur.execute("DROP TABLE IF EXISTS {}".format(name)))
+        loader._tables.pop(name, None)
+        start = time.perf_counter()
+        if method == "copy":
+            for i in range(0, n_rows, loader.batch_size):
+                loader.add(name, samples[i:i + loader.batch_size])
+            loader.join()
+        else:
+            loader.insert(name, samples)
+        elapsed = time.perf_counter() - start
+        print("{:6s} {} rows in {:.3f} s, {:.0f} rows/s".format(method, n_rows, elapsed, n_rows / elapsed))
+        loader._run(lambda cur: cur.execute("DROP TABLE {}".format(name)))
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("path", nargs="?", default="tm_data", help="Telemetry chunks directory (tm_ingest.py)")
+    parser.add_argument("--dsn", default="user={0} dbname=fs_db_{1}".format(os.environ.get('USER'), 1),
+                        help="Database connection string")
+    parser.add_argument("-b", "--batch_size", default=10000, type=int, help="Rows per COPY")
+    parser.add_argument("-p", "--pool_size", default=2, type=int, help="Database connections")
+    parser.add_argument("--bench", default=0, type=int, help="Benchmark COPY against INSERT with N rows")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+
+    tm_loader = TmLoader(args.dsn, args.batch_size, pool_size=args.pool_size)
+    if args.bench:
+        benchmark(tm_loader, args.bench)
+    else:
+        from tm_ingest import load_chunks
+        for c_name in sorted(os.listdir(args.path)):
+            tm_data = load_chunks(args.path, c_name)
+            if tm_data is not None and c_name.endswith("_data_t"):
+                print(c_name, len(tm_data))
+                tm_loader.add(c_name[:-2], tm_data)
+    tm_loader.close()
+    print("Rows: {}, batches: {}, errors: {}".format(tm_loader.rows, tm_loader.batches, tm_loader.errors))
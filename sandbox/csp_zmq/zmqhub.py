@@ -1,6 +1,9 @@
 import re
 import sys
 import zmq
+import json
+import time
+import struct
 import argparse
 from random import randint
 
@@ -11,9 +14,115 @@ from zmqnode import CspZmqNode
 from zmqnode import threaded
 from zmqnode import CspHeader
 
+CTRL_COMMANDS = (b"PAUSE", b"RESUME", b"TERMINATE", b"STATISTICS")
+
+
+def send_control(command, port="8005", ip="localhost", timeout=2000):
+    """
+    Send a control command to a running hub
+    :param command: Str. PAUSE, RESUME, TERMINATE or STATISTICS
+    :param port: Str. Hub control port
+    :param ip: Str. Hub IP address
+    :param timeout: Int. Milliseconds to wait for the reply
+    :return: Dict. Hub reply
+    """
+    ctx = zmq.Context.instance()
+    sock = ctx.socket(zmq.REQ)
+    sock.setsockopt(zmq.RCVTIMEO, timeout)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect('tcp://{}:{}'.format(ip, port))
+    try:
+        sock.send_string(command.upper())
+        return json.loads(sock.recv_string())
+    finally:
+        sock.close()
+
+
+class HubStats(object):
+    _hdr_struct = struct.Struct('<I')
+
+    def __init__(self):
+        """
+        Traffic counters of the hub proxy. Counts frames and bytes per (src, dst, dport) link, dropped frames
+        (only with XPUB_NODROP, see CspZmqHub nodrop, otherwise None) and keeps a histogram of the frames per
+        second rate (log2 buckets, one sample per second).
+
+        >>> stats = HubStats()
+        >>> stats.add(bytes([10, 0, 93, 160, 130]) + b'hello')
+        >>> stats.snapshot()['links']
+        [{'src': 1, 'dst': 10, 'dport': 1, 'frames': 1, 'bytes': 10}]
+        """
+        self.start = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = None
+        self.max_batch = 0
+        self.links = {}
+        self.rate_hist = {}
+        self._window = int(self.start)
+        self._window_frames = 0
+
+    def add(self, frame):
+        """
+        Count a frame forwarded by the hub
+        :param frame: Bytes. MAC byte, CSP header and data
+        :return: None
+        """
+        size = len(frame)
+        self.frames += 1
+        self.bytes += size
+        self._window_frames += 1
+        if size >= 5:
+            hdr_int = self._hdr_struct.unpack_from(frame, 1)[0]
+            key = ((hdr_int >> 25) & 0x1f, (hdr_int >> 20) & 0x1f, (hdr_int >> 14) & 0x3f)
+        else:
+            key = (None, None, None)
+        link = self.links.get(key)
+        if link is None:
+            self.links[key] = [1, size]
+        else:
+            link[0] += 1
+            link[1] += size
+
+    def tick(self, now):
+        """
+        Close the rate windows (one per second) finished before now
+        :param now: Float. time.monotonic() value
+        :return: None
+        """
+        second = int(now)
+        if second > self._window:
+            bucket = 1 << self._window_frames.bit_length() >> 1
+            self.rate_hist[bucket] = self.rate_hist.get(bucket, 0) + 1
+            # Seconds without traffic
+            if second - self._window > 1:
+                self.rate_hist[0] = self.rate_hist.get(0, 0) + second - self._window - 1
+            self._window = second
+            self._window_frames = 0
+
+    def snapshot(self):
+        """
+        Current statistics as a dict, ready to be serialized as JSON
+        :return: Dict.
+        """
+        now = time.monotonic()
+        return {
+            "time": time.time(),
+            "uptime": now - self.start,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "dropped": self.dropped,
+            "max_batch": self.max_batch,
+            "rate_hist": {str(k): v for k, v in sorted(self.rate_hist.items())},
+            "links": [{"src": k[0], "dst": k[1], "dport": k[2], "frames": v[0], "bytes": v[1]}
+                      for k, v in sorted(self.links.items(), key=lambda i: -i[1][1])]
+        }
+
+
 class CspZmqHub(CspZmqNode):
 
-    def __init__(self, in_port="8002", out_port="8001", mon_port="8003", monitor=True, console=False):
+    def __init__(self, in_port="8002", out_port="8001", mon_port="8003", monitor=True, console=False,
+                 stats_port=None, stats_period=1.0, ctrl_port=None, nodrop=False):
         """
         CSP ZMQ HUB
         Is a PUB-SUB proxy that allow to interconnect a set of publisher and subscriber nodes.
@@ -24,11 +133,26 @@ class CspZmqHub(CspZmqNode):
         :param mon_port: monitor port, internal PUB-SUB socket.
         :param monitor: activate monitor
         :param console: activate console
+        :param stats_port: statistics port, PUB socket. If set, the hub runs an instrumented proxy that
+            publishes a JSON HubStats snapshot every stats_period seconds.
+        :param stats_period: seconds between statistics snapshots
+        :param ctrl_port: control port, REP socket. If set, the proxy can be steered with PAUSE, RESUME,
+            TERMINATE and STATISTICS commands (see send_control) without restarting the connected nodes.
+        :param nodrop: instrumented proxy only. Set XPUB_NODROP to count the frames dropped at the subscribers
+            high water mark. Caveat: a frame that does not fit in the queue of any subscriber is then dropped for
+            all of them, so one stalled node or monitor drops the traffic of every node. By default frames are
+            delivered as zmq.proxy does (only the full subscribers miss them) and drops are not counted.
         """
         CspZmqNode.__init__(self, None, 'localhost', mon_port, in_port, monitor, console)
         self.mon_port_hub = mon_port
         self.out_port_hub = out_port
         self.in_port_hub = in_port
+        self.stats_port_hub = stats_port
+        self.stats_period = stats_period
+        self.ctrl_port_hub = ctrl_port
+        self.nodrop = nodrop
+        self.stats = HubStats()
+        self._control_th = None
 
     def read_message(self, message, header=None):
         print(message)
@@ -55,6 +179,113 @@ class CspZmqHub(CspZmqNode):
             print(e)
         print("Console stopped!")
 
+    @threaded
+    def _control(self, ctrl_addr):
+        """
+        Thread to receive control commands in the control port and forward them to the proxy
+        :param ctrl_addr: Str. Address of the proxy control PAIR socket
+        :return: Thread.
+        """
+        sock = self._context.socket(zmq.REP)
+        sock.setsockopt(zmq.RCVTIMEO, 1000)
+        sock.bind('tcp://*:{}'.format(self.ctrl_port_hub))
+        ctrl = self._context.socket(zmq.PAIR)
+        ctrl.setsockopt(zmq.RCVTIMEO, 1000)
+        ctrl.connect(ctrl_addr)
+        print("Control started!")
+
+        while self._run:
+            try:
+                command = sock.recv()
+            except zmq.error.Again:
+                continue
+
+            if command not in CTRL_COMMANDS:
+                reply = {"error": "Unknown command {}".format(command.decode('ascii', 'replace'))}
+            else:
+                ctrl.send(command)
+                reply = {"command": command.decode('ascii')}
+                # The proxy acknowledges commands with an empty frame, or a JSON snapshot for STATISTICS
+                ack = ctrl.recv() if ctrl.poll(1000) else None
+                if ack is None:
+                    reply["error"] = "Proxy not responding"
+                elif ack:
+                    reply["stats"] = json.loads(ack)
+            sock.send_string(json.dumps(reply))
+
+            if command == b"TERMINATE":
+                break
+
+        ctrl.setsockopt(zmq.LINGER, 0)
+        ctrl.close()
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.close()
+        print("Control stopped!")
+
+    def _proxy(self, xsub_in, xpub_out, s_mon, s_stats=None, s_ctrl=None):
+        """
+        Instrumented and steerable XSUB-XPUB proxy (blocking). Forwards frames as zmq.proxy does while
+        counting traffic. With nodrop, frames that can not be delivered because a subscriber reached its high
+        water mark are counted as dropped (see the caveat in CspZmqHub). zmq.proxy_steerable is not used
+        because libzmq 4.3.5 keeps forwarding frames while paused.
+        :param xsub_in: ZMQ XSUB socket. Nodes output
+        :param xpub_out: ZMQ XPUB socket. Nodes input
+        :param s_mon: ZMQ PUB socket. Monitor, can be None
+        :param s_stats: ZMQ PUB socket. Statistics snapshots, can be None
+        :param s_ctrl: ZMQ PAIR socket. Control commands (PAUSE, RESUME, TERMINATE, STATISTICS), can be None
+        :return: None
+        """
+        if self.nodrop:
+            xpub_out.setsockopt(zmq.XPUB_NODROP, 1)
+            self.stats.dropped = 0
+        poller = zmq.Poller()
+        poller.register(xsub_in, zmq.POLLIN)
+        poller.register(xpub_out, zmq.POLLIN)
+        if s_ctrl is not None:
+            poller.register(s_ctrl, zmq.POLLIN)
+        stats = self.stats
+        next_snapshot = time.monotonic() + self.stats_period
+
+        while self._run:
+            events = dict(poller.poll(100))
+            if s_ctrl in events:
+                command = s_ctrl.recv()
+                if command == b"STATISTICS":
+                    s_ctrl.send_string(json.dumps(stats.snapshot()))
+                    continue
+                s_ctrl.send(b"")
+                if command == b"PAUSE" and xsub_in in dict(poller.sockets):
+                    # Frames wait in the sockets queues until resumed
+                    poller.unregister(xsub_in)
+                elif command == b"RESUME" and xsub_in not in dict(poller.sockets):
+                    poller.register(xsub_in, zmq.POLLIN)
+                elif command == b"TERMINATE":
+                    break
+            if xpub_out in events:
+                # Subscriptions from nodes
+                while xpub_out.poll(0):
+                    xsub_in.send_multipart(xpub_out.recv_multipart())
+            if xsub_in in events:
+                batch = 0
+                while xsub_in.poll(0) and batch < 1000:
+                    msg = xsub_in.recv_multipart()
+                    batch += 1
+                    stats.add(msg[0])
+                    try:
+                        xpub_out.send_multipart(msg, zmq.NOBLOCK)
+                    except zmq.error.Again:
+                        # Only raised with XPUB_NODROP
+                        stats.dropped += 1
+                    if s_mon is not None:
+                        s_mon.send_multipart(msg)
+                stats.max_batch = max(stats.max_batch, batch)
+
+            now = time.monotonic()
+            stats.tick(now)
+            if s_stats is not None and now >= next_snapshot:
+                s_stats.send_string(json.dumps(stats.snapshot()))
+                next_snapshot = now + self.stats_period
+
     def start(self):
         # Start default writer and reader
         CspZmqNode.start(self)
@@ -71,12 +302,29 @@ class CspZmqHub(CspZmqNode):
             s_mon = self._context.socket(zmq.PUB)
             s_mon.bind('tcp://*:{}'.format(self.mon_port_hub))
 
+        s_stats = None
+        if self.stats_port_hub:
+            # Create statistics socket
+            s_stats = self._context.socket(zmq.PUB)
+            s_stats.bind('tcp://*:{}'.format(self.stats_port_hub))
+
+        s_ctrl = None
+        if self.ctrl_port_hub:
+            # Create control socket, commands arrive from the control thread
+            ctrl_addr = 'inproc://hub-control-{}'.format(id(self))
+            s_ctrl = self._context.socket(zmq.PAIR)
+            s_ctrl.bind(ctrl_addr)
+            self._control_th = self._control(ctrl_addr)
+
         if self.console:
             self.console_hub()
 
         # Start ZMQ proxy (blocking)
         try:
-            zmq.proxy(xsub_in, xpub_out, s_mon)
+            if s_stats is not None or s_ctrl is not None:
+                self._proxy(xsub_in, xpub_out, s_mon, s_stats, s_ctrl)
+            else:
+                zmq.proxy(xsub_in, xpub_out, s_mon)
 
         except KeyboardInterrupt as e:
             print("Main:", e)
@@ -88,9 +336,20 @@ class CspZmqHub(CspZmqNode):
             xpub_out.close()
             if s_mon:
                 s_mon.close()
+            if s_stats:
+                s_stats.close()
+            if s_ctrl:
+                s_ctrl.setsockopt(zmq.LINGER, 0)
+                s_ctrl.close()
 
             self.stop()
 
+    def stop(self):
+        self._run = False
+        if self._control_th is not None:
+            self._control_th.join()
+        CspZmqNode.stop(self)
+
 
 def get_parameters():
     """ Parse command line parameters """
@@ -99,6 +358,14 @@ def get_parameters():
     parser.add_argument("-i", "--in_port", default="8002", help="Input port")
     parser.add_argument("-o", "--out_port", default="8001", help="Output port")
     parser.add_argument("-m", "--mon_port", default="8003", help="Monitor port")
+    parser.add_argument("-s", "--stats_port", default=None, help="Statistics port, enables traffic statistics")
+    parser.add_argument("--stats_period", default=1.0, type=float, help="Seconds between statistics snapshots")
+    parser.add_argument("-c", "--ctrl_port", default=None, help="Control port, enables proxy steering")
+    parser.add_argument("--nodrop", action="store_true",
+                        help="Count frames dropped at subscribers HWM (XPUB_NODROP). A full subscriber then drops "
+                             "the frame for all subscribers")
+    parser.add_argument("--send", default=None, choices=[c.decode() for c in CTRL_COMMANDS],
+                        help="Send a control command to a running hub and exit")
     parser.add_argument("--mon", action="store_true", help="Enable monitor socket")
     parser.add_argument("--con", action="store_true", help="Enable console task")
 
@@ -109,7 +376,12 @@ if __name__ == "__main__":
     # Get arguments
     args = get_parameters()
     print(args)
-    zmqhub = CspZmqHub(args.in_port, args.out_port, args.mon_port, args.mon, args.con)
+    if args.send:
+        print(send_control(args.send, args.ctrl_port or "8005"))
+        sys.exit(0)
+
+    zmqhub = CspZmqHub(args.in_port, args.out_port, args.mon_port, args.mon, args.con, args.stats_port,
+                       args.stats_period, args.ctrl_port, args.nodrop)
     zmqhub.start()
 
 
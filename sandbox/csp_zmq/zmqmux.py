@@ -0,0 +1,141 @@
+import zmq
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from zmqnode import CspZmqNode, parse_frame
+
+
+class CspZmqMux(CspZmqNode):
+
+    def __init__(self, hub_ip='localhost', in_port="8001", out_port="8002", copy=True, queue_size=0):
+        """
+        CSP ZMQ NODE MULTIPLEXER
+        Hosts many nodes in one process using a single SUB and a single PUB socket. The SUB socket subscribes
+        once per registered node address and each frame is dispatched to the handlers of its destination (MAC)
+        byte. A test bench with N simulated nodes then opens 2 connections to the hub instead of 2*N.
+        NODE_1..N <--> MUX:PUB:OUT_PORT <----> HUB:XSUB:IN_PORT|::|HUB:XPUB:OUT_PORT <----> MUX:SUB:IN_PORT
+
+        :param hub_ip: Str. Hub node IP address
+        :param in_port: Str. Input port, SUB socket. (Should match hub output port, XPUB sockets)
+        :param out_port: Str. Output port, PUB socket. (Should match hub input port, XSUB sockets)
+        :param copy: Bool. Set to False to pass memoryview slices to the handlers (zero-copy).
+        :param queue_size: Int. Max messages waiting to be sent, 0 for an unbounded queue.
+
+        >>> mux = CspZmqMux()
+        >>> mux.register(10, lambda msg, hdr: print(10, msg, hdr))
+        >>> mux.register(11, lambda msg, hdr: print(11, msg, hdr))
+        >>> mux.nodes
+        [10, 11]
+
+        Hosted nodes keep their routes
+        >>> from zmqnode import CspHeader
+        >>> node = CspZmqNode(12)
+        >>> @node.route(10, "obc_get_mem")
+        ... def get_mem(message, header):
+        ...     print("mem", message)
+        >>> mux.register(12, node)
+        >>> mux._read_frame(bytes([12]) + CspHeader(1, 12, 20, 10).to_bytes() + b'obc_get_mem 1')
+        mem b'obc_get_mem 1'
+        """
+        CspZmqNode.__init__(self, None, hub_ip, in_port, out_port, monitor=True, console=True, copy=copy,
+                            queue_size=queue_size)
+        # {node: [(hosted, handler), ...]}, hosted node handlers receive the whole frame
+        self._handlers = {}
+        self._hosted = []
+
+    @property
+    def nodes(self):
+        """ List of registered node addresses """
+        return sorted(self._handlers)
+
+    def register(self, node, handler):
+        """
+        Register a handler for messages sent to a node. Must be called before start().
+        The handler can be a callable receiving (message, header), or a CspZmqNode (or subclass). In the
+        latter case frames are dispatched as the node reader does, using its routes (see CspZmqNode.route),
+        read_message and worker threads, and its send_message is routed through the multiplexer writer, so
+        the node must not be started on its own.
+        :param node: Int. Node address
+        :param handler: CspZmqNode or callable.
+        :return: None
+        """
+        hosted = isinstance(handler, CspZmqNode)
+        if hosted:
+            handler._queue = self._queue
+            self._hosted.append(handler)
+            handler = handler._read_frame
+        self._handlers.setdefault(int(node), []).append((hosted, handler))
+
+    def unregister(self, node):
+        """
+        Remove all handlers of a node. Frames to this node are ignored from now on.
+        :param node: Int. Node address
+        :return: None
+        """
+        self._handlers.pop(int(node), None)
+
+    def _read_frame(self, frame):
+        """
+        Dispatch a received frame to the handlers of its destination (MAC) byte
+        :param frame: Bytes or memoryview. MAC byte, CSP header and data
+        :return: None
+        """
+        handlers = self._handlers.get(frame[0])
+        if handlers is None:
+            return
+        data, csp_header = parse_frame(frame)
+        for hosted, handler in handlers:
+            if hosted:
+                handler(frame)
+            else:
+                handler(data, csp_header)
+
+    def start(self):
+        """
+        Starts the multiplexer reader and writer threads, subscribing to all registered nodes, and the worker
+        threads of the hosted nodes
+        :return: None
+        """
+        self._context = zmq.Context()
+        for node in self._hosted:
+            if node.workers:
+                node._executor = ThreadPoolExecutor(node.workers)
+        self._reader_th = self._reader(self.nodes, self.in_port, self.hub_ip, self._context)
+        self._writer_th = self._writer(self.node, self.out_port, self.hub_ip, self._context)
+
+    def stop(self):
+        CspZmqNode.stop(self)
+        for node in self._hosted:
+            if node._executor is not None:
+                node._executor.shutdown()
+                node._executor = None
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("nodes", nargs="+", type=int, help="Nodes addresses to monitor")
+    parser.add_argument("-d", "--ip", default="localhost", help="Hub IP address")
+    parser.add_argument("-i", "--in_port", default="8001", help="Input port")
+    parser.add_argument("-o", "--out_port", default="8002", help="Output port")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+
+    mux = CspZmqMux(args.ip, args.in_port, args.out_port)
+    for n in args.nodes:
+        mux.register(n, lambda msg, hdr, n=n: print(n, msg, hdr))
+    mux.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        mux.stop()
@@ -1,8 +1,14 @@
-import re
 import zmq
+import struct
 import argparse
+from functools import lru_cache
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
-from queue import Queue
+from queue import Queue, Empty, Full
+
+# CSP headers are sent as a little endian 32 bits integer
+_hdr_struct = struct.Struct('<I')
 
 
 def threaded(fn):
@@ -17,7 +23,31 @@ class StopedException(Exception):
     pass
 
 
+@lru_cache(maxsize=4096)
+def _dump_header(prio, src_node, dst_node, dst_port, src_port, flags):
+    """
+    Build the header bytes from its fields. Results are cached so the usual
+    (src, dst, sport, dport) tuples of a session are only packed once.
+    :param prio: Int. Priority (2 bits)
+    :param src_node: Int. Source node (5 bits)
+    :param dst_node: Int. Destination node (5 bits)
+    :param dst_port: Int. Destination port (6 bits)
+    :param src_port: Int. Source port (6 bits)
+    :param flags: Int. HMAC, XTEA, RDP, CRC32 flags (4 bits)
+    :return: Bytes. Header as 4 bytes, little endian
+
+    >>> _dump_header(2, 10, 11, 47, 1, 0)
+    b'\\x00\\xc1\\xbb\\x94'
+    """
+    hdr_int = ((prio & 0x03) << 30) | ((src_node & 0x1f) << 25) | ((dst_node & 0x1f) << 20) | \
+              ((dst_port & 0x3f) << 14) | ((src_port & 0x3f) << 8) | (flags & 0x0f)
+    return _hdr_struct.pack(hdr_int)
+
+
 class CspHeader(object):
+    __slots__ = ('src_node', 'dst_node', 'src_port', 'dst_port', 'prio',
+                 'hmac', 'xtea', 'rdp', 'crc32', 'mac_node', '__bytes')
+
     def __init__(self, src_node=None, dst_node=None, src_port=None, dst_port=None, prio=2, hdr_bytes=None):
         """
         Represents a CSP header
@@ -61,7 +91,7 @@ class CspHeader(object):
         return self.__bytes.hex()
 
     def __int__(self):
-        return int(self.__bytes.hex(), 16)
+        return int.from_bytes(self.__bytes, 'big')
 
     def __hex__(self):
         return self.__bytes.hex()
@@ -83,12 +113,21 @@ class CspHeader(object):
         1
         """
         assert len(hdr_bytes) == 4
-        self.__bytes = hdr_bytes
-        hdr_hex = bytes(reversed(hdr_bytes)).hex()
-        print(hdr_hex)
-        hdr_int = int(hdr_hex, 16)
-        print(hdr_int)
-        self.__parse(hdr_int)
+        # Copy the 4 bytes, a memoryview (zero-copy reader) would keep the whole frame alive
+        self.__bytes = bytes(hdr_bytes)
+        self.__parse(_hdr_struct.unpack(hdr_bytes)[0])
+
+    def freeze(self):
+        """
+        Return an immutable and hashable copy of this header
+        :return: FrozenCspHeader
+
+        >>> hdr = CspHeader(src_node=1, dst_node=2, src_port=10, dst_port=20)
+        >>> hdr.freeze() == CspHeader(src_node=1, dst_node=2, src_port=10, dst_port=20).freeze()
+        True
+        """
+        return FrozenCspHeader(self.prio, self.src_node, self.dst_node, self.dst_port, self.src_port,
+                               self.hmac, self.xtea, self.rdp, self.crc32, self.mac_node)
 
     def to_bytes(self):
         """
@@ -140,18 +179,126 @@ class CspHeader(object):
         self.mac_node = self.dst_node
 
     def __dump(self):
-        #          Prio   SRC   DST    DP   SP  RES    H     X      R    C
-        header = "{:02b}{:05b}{:05b}{:06b}{:06b}0000{:01b}{:01b}{:01b}{:01b}"
-        hdr_bin = header.format(self.prio, self.src_node, self.dst_node, self.dst_port,
-                                self.src_port, self.hmac, self.xtea, self.rdp, self.crc32)
-        hdr_bin = re.findall("........", hdr_bin)[::-1]
-        hdr_bytes = bytes([int(i, 2) for i in hdr_bin])
-        return hdr_bytes
+        #   Prio   SRC   DST    DP   SP  RES    H     X      R    C
+        flags = (bool(self.hmac) << 3) | (bool(self.xtea) << 2) | (bool(self.rdp) << 1) | bool(self.crc32)
+        return _dump_header(self.prio, self.src_node, self.dst_node, self.dst_port, self.src_port, flags)
+
+
+_FrozenCspHeader = namedtuple('_FrozenCspHeader', ('prio', 'src_node', 'dst_node', 'dst_port', 'src_port',
+                                                   'hmac', 'xtea', 'rdp', 'crc32', 'mac_node'))
+
+
+class FrozenCspHeader(_FrozenCspHeader):
+    """
+    Immutable and hashable CSP header, can be used as dict key for routing
+    tables or duplicates detection. Keeps the CspHeader API, but resend
+    returns a new header instead of modifying this one.
+
+    >>> hdr = FrozenCspHeader.from_bytes(bytes([0, 93, 160, 130]))
+    >>> hdr.dst_node, hdr.dst_port
+    (10, 1)
+    >>> hdr.to_bytes() == bytes([0, 93, 160, 130])
+    True
+    >>> {hdr: 1}[hdr.resend().resend()]
+    1
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_bytes(cls, hdr_bytes, mac_node=None):
+        """
+        Parse header from byte array
+        :param hdr_bytes: Array containing header bytes
+        :param mac_node: Int. MAC byte of the frame, None to use the destination node
+        :return: FrozenCspHeader
+
+        >>> FrozenCspHeader.from_bytes(bytes([0, 93, 160, 130]), mac_node=3).mac_node
+        3
+        """
+        hdr_int = _hdr_struct.unpack(hdr_bytes)[0]
+        dst_node = (hdr_int >> 20) & 0x1f
+        return cls((hdr_int >> 30) & 0x03, (hdr_int >> 25) & 0x1f, dst_node, (hdr_int >> 14) & 0x3f,
+                   (hdr_int >> 8) & 0x3f, bool(hdr_int & 0x08), bool(hdr_int & 0x04), bool(hdr_int & 0x02),
+                   bool(hdr_int & 0x01), dst_node if mac_node is None else mac_node)
+
+    def __str__(self):
+        return "S {}, D {}, Dp {}, Sp {}, Pr {}, HMAC {} XTEA {} RDP {} CRC32 {}".format(
+            self.src_node,
+            self.dst_node,
+            self.dst_port,
+            self.src_port,
+            self.prio,
+            self.hmac,
+            self.xtea,
+            self.rdp,
+            self.crc32)
+
+    def __int__(self):
+        return int.from_bytes(self.to_bytes(), 'big')
+
+    def __bytes__(self):
+        return self.to_bytes()
+
+    def to_bytes(self):
+        """
+        Return the header as a byte array
+        :return: Byte array
+        """
+        flags = (bool(self.hmac) << 3) | (bool(self.xtea) << 2) | (bool(self.rdp) << 1) | bool(self.crc32)
+        return _dump_header(self.prio, self.src_node, self.dst_node, self.dst_port, self.src_port, flags)
+
+    def resend(self):
+        """
+        Swap node and port fields to create a response header
+        :return: FrozenCspHeader. A new header
+
+        >>> hdr = FrozenCspHeader(2, 1, 2, 20, 10, False, False, False, False, 2)
+        >>> rsp = hdr.resend()
+        >>> rsp.src_node, rsp.src_port, rsp.mac_node
+        (2, 20, 1)
+        """
+        return self._replace(src_node=self.dst_node, dst_node=self.src_node, src_port=self.dst_port,
+                             dst_port=self.src_port, mac_node=self.src_node)
+
+    def thaw(self):
+        """
+        Return a mutable CspHeader copy of this header
+        :return: CspHeader
+        """
+        hdr = CspHeader(self.src_node, self.dst_node, self.src_port, self.dst_port, self.prio)
+        hdr.hmac, hdr.xtea, hdr.rdp, hdr.crc32 = self.hmac, self.xtea, self.rdp, self.crc32
+        hdr.mac_node = self.mac_node
+        return hdr
+
+
+def parse_frame(frame):
+    """
+    Split a frame received from the hub in data and CSP header
+    :param frame: Bytes or memoryview. MAC byte, CSP header and data
+    :return: Tuple. (data, CspHeader), header is None if it can not be parsed
+
+    >>> data, hdr = parse_frame(bytes([10, 0, 93, 160, 130]) + b'hello')
+    >>> data, hdr.dst_node, hdr.dst_port
+    (b'hello', 10, 1)
+
+    Zero-copy frames (memoryview)
+    >>> data, hdr = parse_frame(memoryview(bytes([10, 0, 93, 160, 130]) + b'hello'))
+    >>> bytes(data), bytes(hdr)
+    (b'hello', b'\\x00]\\xa0\\x82')
+    """
+    try:
+        csp_header = CspHeader()
+        csp_header.from_bytes(frame[1:5])
+    except:
+        csp_header = None
+
+    return frame[5:], csp_header
 
 
 class CspZmqNode(object):
 
-    def __init__(self, node, hub_ip='localhost', in_port="8001", out_port="8002", monitor=True, console=False):
+    def __init__(self, node, hub_ip='localhost', in_port="8001", out_port="8002", monitor=True, console=False,
+                 copy=True, batch_size=64, queue_size=0, workers=0):
         """
         CSP ZMQ NODE
         Is a PUB-SUB node connected to other nodes via the XSUB-XPUB hub
@@ -163,6 +310,16 @@ class CspZmqNode(object):
         :param out_port: Str. Output port, PUB socket. (Should match hub input port, XSUB sockets)
         :param monitor: Bool. Activate reader.
         :param console: Bool. Activate writer.
+        :param copy: Bool. Reader copies each frame and passes bytes to read_message. Set to False to receive
+            memoryview slices over the zmq.Frame buffer instead (zero-copy). Keep a reference or call bytes()
+            on them if they must outlive read_message.
+        :param batch_size: Int. Max number of messages the writer takes from the queue at once, it only takes
+            the messages already queued and does not wait for more.
+        :param queue_size: Int. Max messages waiting to be sent, send_message blocks when the queue is full
+            (counted in self.queue_full). Use 0 for an unbounded queue. Frames sent by the writer are counted
+            in self.sent, and the ones it could not send before the node stopped in self.dropped (see _send).
+        :param workers: Int. Number of worker threads to run message handlers, so slow handlers do not block
+            the reader. Use 0 to run handlers in the reader thread.
 
         >>> import time
         >>> node_1 = CspZmqNode(10)
@@ -177,8 +334,16 @@ class CspZmqNode(object):
         self.in_port = in_port
         self.monitor = monitor
         self.console = console
+        self.copy = copy
+        self.batch_size = batch_size
+        self.queue_full = 0
+        self.sent = 0
+        self.dropped = 0
+        self.workers = workers
+        self._routes = {}
+        self._executor = None
         self._context = None
-        self._queue = Queue()
+        self._queue = Queue(queue_size)
         self._writer_th = None
         self._reader_th = None
         self._run = True
@@ -188,41 +353,26 @@ class CspZmqNode(object):
         """
         Thread to read messages
         :param node: Int. Node to subscribe, usually self.node, use None to subscribe to all node messages.
+            Can also be a list of nodes to subscribe.
         :param port: Str. Port to read message (SUB socket)
         :param ip: Str. Hub IP address, can be a remote node
         :param ctx: ZmqContext. Usually self._context or None to create a new context.
         :return: Thread.
         """
         _ctx = ctx if ctx is not None else zmq.Context(1)
-        sock = _ctx.socket(zmq.SUB)
-        sock.setsockopt(zmq.SUBSCRIBE, chr(int(node)).encode('ascii') if node is not None else b'')
+        sock = self._reader_socket(_ctx, node, port, ip)
         sock.setsockopt(zmq.RCVTIMEO, 1000)
-        sock.connect('tcp://{}:{}'.format(ip, port))
         print("Reader started!")
 
         while self._run:
-            # print("reading")
             try:
-                frame = sock.recv_multipart()[0]
-                # print(frame)
-                header = frame[1:5]
-                data = frame[5:]
-                print(header)
-                try:
-                    csp_header = CspHeader()
-                    csp_header.from_bytes(header)
-                except:
-                    csp_header = None
-
-                # if self.monitor:
-                #     print('\nMON:', frame)
-                #     print('\tHeader: {},'.format(csp_header))
-                #     print('\tData: {}'.format(data))
-
-                print("Header", csp_header)
-                self.read_message(data, csp_header)
+                if self.copy:
+                    frame = sock.recv_multipart()[0]
+                else:
+                    frame = sock.recv(copy=False).buffer
+                self._read_frame(frame)
             except zmq.error.Again:
-                pass
+                self._reader_idle(sock)
 
         sock.setsockopt(zmq.LINGER, 0)
         sock.close()
@@ -230,6 +380,90 @@ class CspZmqNode(object):
             _ctx.terminate()
         print("Reader stopped!")
 
+    def _reader_idle(self, sock):
+        """
+        Called by the reader thread when no frame arrived in the last second
+        :param sock: ZMQ socket. Reader socket
+        :return: None
+        """
+        pass
+
+    def _reader_socket(self, ctx, node, port, ip):
+        """
+        Create and connect the reader socket, a SUB socket subscribed to the node(s) address
+        :param ctx: ZmqContext.
+        :param node: Int, list or None. Node(s) to subscribe, None to subscribe to all nodes
+        :param port: Str. Hub port
+        :param ip: Str. Hub IP address
+        :return: ZMQ socket.
+        """
+        sock = ctx.socket(zmq.SUB)
+        for _node in (node if isinstance(node, (list, tuple)) else [node]):
+            sock.setsockopt(zmq.SUBSCRIBE, bytes((int(_node),)) if _node is not None else b'')
+        sock.connect('tcp://{}:{}'.format(ip, port))
+        return sock
+
+    def _writer_socket(self, ctx, port, ip):
+        """
+        Create and connect the writer socket, a PUB socket
+        :param ctx: ZmqContext.
+        :param port: Str. Hub port
+        :param ip: Str. Hub IP address
+        :return: ZMQ socket.
+        """
+        sock = ctx.socket(zmq.PUB)
+        sock.connect('tcp://{}:{}'.format(ip, port))
+        return sock
+
+    def _read_frame(self, frame):
+        """
+        Parse a received frame and pass it to read_message. Called by the reader thread for each frame.
+        :param frame: Bytes or memoryview. MAC byte, CSP header and data
+        :return: None
+        """
+        data, csp_header = parse_frame(frame)
+        handler = self.read_message
+        if csp_header is not None and csp_header.dst_port in self._routes:
+            commands = self._routes[csp_header.dst_port]
+            command = bytes(data[:64]).split(b' ', 1)[0].rstrip(b'\x00\r\n')
+            handler = commands.get(command) or commands.get(None, handler)
+
+        if self._executor is not None:
+            self._executor.submit(self._handle, handler, data, csp_header)
+        else:
+            handler(data, csp_header)
+
+    @staticmethod
+    def _handle(handler, data, csp_header):
+        """ Run a message handler in a worker thread, reporting its errors """
+        try:
+            handler(data, csp_header)
+        except Exception as e:
+            print("Handler error:", e)
+
+    def route(self, port, command=None):
+        """
+        Decorator to register a handler for messages to a port, and optionally starting with a command name
+        (the first word of the message). Handlers receive (message, header) as read_message. Messages without
+        a matching handler are passed to read_message.
+
+        :param port: Int. Destination port
+        :param command: Str. Command name, None to handle all messages to the port
+        :return: Decorator
+
+        >>> node = CspZmqNode(10)
+        >>> @node.route(10, "obc_get_mem")
+        ... def get_mem(message, header):
+        ...     print("mem", message)
+        >>> node._read_frame(bytes([10]) + CspHeader(1, 10, 20, 10).to_bytes() + b'obc_get_mem 1')
+        mem b'obc_get_mem 1'
+        """
+        def decorator(handler):
+            key = command.encode('ascii') if command is not None else None
+            self._routes.setdefault(int(port), {})[key] = handler
+            return handler
+        return decorator
+
     @threaded
     def _writer(self, origin, port="8002", ip="localhost", ctx=None):
         """
@@ -241,36 +475,70 @@ class CspZmqNode(object):
         :return: Thread.
         """
         _ctx = ctx if ctx is not None else zmq.Context(1)
-        sock = _ctx.socket(zmq.PUB)
-        sock.connect('tcp://{}:{}'.format(ip, port))
+        sock = self._writer_socket(_ctx, port, ip)
+        sock.setsockopt(zmq.SNDTIMEO, 1000)
+        # Messages are built in this buffer, it only grows for larger payloads
+        buffer = bytearray(256)
         print("Writer started!")
         while self._run:
-            try:
-                # dnode, dport, sport, data = self._queue.get()
-                data, csp_header = self._queue.get()
-                #print("W:", csp_header, data)
-                if len(data) > 0:
-                    # Get CSP header and data
-                    hdr = csp_header.to_bytes()
-                    msg = bytearray([int(csp_header.mac_node), ]) + hdr + bytearray(data, "ascii")
-                    # print("con:", msg)
-                    sock.send(msg)
-            except Exception as e:
-                print(e)
-                break
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Empty:
+                    break
 
-        sock.setsockopt(zmq.LINGER, 0)
+            for data, csp_header in batch:
+                try:
+                    if csp_header is None or len(data) == 0:
+                        continue
+                    # Get CSP header and data
+                    if isinstance(data, str):
+                        data = data.encode("ascii")
+                    size = len(data) + 5
+                    if size > len(buffer):
+                        buffer = bytearray(size)
+                    buffer[0] = int(csp_header.mac_node)
+                    buffer[1:5] = csp_header.to_bytes()
+                    buffer[5:size] = data
+                    self._send(sock, memoryview(buffer)[:size])
+                except Exception as e:
+                    print("Writer error:", e)
+                finally:
+                    self._queue.task_done()
+
+        # Give the frames already sent to the socket some time to go out
+        sock.setsockopt(zmq.LINGER, 1000)
         sock.close()
         if not ctx:
             _ctx.terminate()
         print("Writer stopped!")
 
+    def _send(self, sock, frame):
+        """
+        Send a frame from the writer thread. PUB sockets never block, frames are silently dropped at the high
+        water mark. Other sockets (DEALER) block while the hub is slow or gone, the send is retried every second
+        until it succeeds or the node stops, then the frame is counted in self.dropped.
+        :param sock: ZMQ socket. Writer socket
+        :param frame: Bytes or memoryview. MAC byte, CSP header and data
+        :return: None
+        """
+        while True:
+            try:
+                sock.send(frame, 0 if self._run else zmq.NOBLOCK)
+                self.sent += 1
+                return
+            except zmq.error.Again:
+                if not self._run:
+                    self.dropped += 1
+                    return
+
     def read_message(self, message, header=None):
         """
         Overwrite this method to process incoming messages. This function is automatically called by the reader thread
         when a new message arrives.
 
-        :param message: Str. Message received
+        :param message: Bytes. Message received (memoryview if the node was created with copy=False)
         :param header: CspHeader. CSP header
         :return:
         """
@@ -284,8 +552,10 @@ class CspZmqNode(object):
         In general you do not need to overwrite this function, instead, you can simple use
         this function from your main thread.
         This function is thread safe because it uses a Queue to connect with the writer thread.
+        If the node was created with a queue_size, this function blocks while the queue is full, the number of
+        calls that had to wait is counted in self.queue_full.
 
-        :param message: Str. Message to send.
+        :param message: Str, Bytes or memoryview. Message to send.
         :param header: CspHeader. CSP header object
         :return: None
 
@@ -296,7 +566,11 @@ class CspZmqNode(object):
         >>> node_1.stop()
         W: S 10, D 11, Dp 47, Sp 1, Pr 2, HMAC False XTEA False RDP False CRC32 False hello_world
         """
-        self._queue.put((message, header))
+        try:
+            self._queue.put_nowait((message, header))
+        except Full:
+            self.queue_full += 1
+            self._queue.put((message, header))
 
     def start(self):
         """
@@ -306,11 +580,20 @@ class CspZmqNode(object):
         :return: None
         """
         self._context = zmq.Context()
+        if self.workers:
+            self._executor = ThreadPoolExecutor(self.workers)
         if self.monitor:
             self._reader_th = self._reader(self.node, self.in_port, self.hub_ip, self._context)
         if self.console:
             self._writer_th = self._writer(self.node, self.out_port, self.hub_ip, self._context)
 
+    def flush(self):
+        """
+        Wait until the writer has sent all the queued messages. The writer must be running.
+        :return: None
+        """
+        self._queue.join()
+
     def join(self):
         """
         This function joins the reader and writer threads. Can be used in the main thread to
@@ -324,8 +607,15 @@ class CspZmqNode(object):
 
     def stop(self):
         self._run = False
-        self._queue.put(("", "", ""))
+        try:
+            # Wake up the writer if it waits for messages
+            self._queue.put_nowait(("", None))
+        except Full:
+            pass
         self.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
         self._context.term()
 
 
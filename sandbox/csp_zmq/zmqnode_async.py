@@ -0,0 +1,171 @@
+import zmq
+import asyncio
+import argparse
+import zmq.asyncio
+
+from zmqnode import parse_frame
+
+
+class AsyncCspZmqNode(object):
+
+    def __init__(self, node, hub_ip='localhost', in_port="8001", out_port="8002", monitor=True, console=False,
+                 copy=True, ctx=None):
+        """
+        CSP ZMQ NODE over asyncio
+        Same as CspZmqNode but running in an asyncio event loop instead of reader and writer threads, so one
+        process can host many nodes. All nodes share the zmq.asyncio context by default.
+        NODE:PUB:OUT_PORT <----> HUB:XSUB:IN_PORT|::|HUB:XPUB:OUT_PORT <----> NODE:SUB:IN_PORT
+
+        :param node: Int. This node address
+        :param hub_ip: Str. Hub node IP address
+        :param in_port: Str. Input port, SUB socket. (Should match hub output port, XPUB sockets)
+        :param out_port: Str. Output port, PUB socket. (Should match hub input port, XSUB sockets)
+        :param monitor: Bool. Activate reader.
+        :param console: Bool. Activate writer.
+        :param copy: Bool. Set to False to pass memoryview slices to read_message (zero-copy).
+        :param ctx: zmq.asyncio.Context. Context to use, None to use the shared instance.
+
+        >>> async def main():
+        ...     node_1 = AsyncCspZmqNode(10)
+        ...     async def read_message(msg, hdr): print(msg, hdr)
+        ...     node_1.read_message = read_message
+        ...     await node_1.start()
+        ...     await asyncio.sleep(1)
+        ...     await node_1.stop()
+        >>> asyncio.run(main())
+        Reader started!
+        Reader stopped!
+        """
+        self.node = int(node) if node else None
+        self.hub_ip = hub_ip
+        self.out_port = out_port
+        self.in_port = in_port
+        self.monitor = monitor
+        self.console = console
+        self.copy = copy
+        self._context = ctx
+        self._sub = None
+        self._pub = None
+        self._reader_task = None
+
+    async def _reader(self):
+        """
+        Task to read messages, runs until cancelled
+        :return: None
+        """
+        print("Reader started!")
+        try:
+            while True:
+                if self.copy:
+                    frame = await self._sub.recv()
+                else:
+                    frame = (await self._sub.recv(copy=False)).buffer
+                try:
+                    await self.read_message(*parse_frame(frame))
+                except Exception as e:
+                    print("Handler error:", e)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            print("Reader stopped!")
+
+    async def read_message(self, message, header=None):
+        """
+        Overwrite this coroutine to process incoming messages. This function is automatically awaited by the
+        reader task when a new message arrives. Do not block the event loop inside this function.
+
+        :param message: Bytes. Message received (memoryview if the node was created with copy=False)
+        :param header: CspHeader. CSP header
+        :return:
+        """
+        raise NotImplementedError
+
+    async def send_message(self, message, header=None):
+        """
+        Call this coroutine to send messages to another node. Destination node, port,
+        and other options are contained in the header.
+
+        :param message: Str, Bytes or memoryview. Message to send.
+        :param header: CspHeader. CSP header object
+        :return: None
+        """
+        if len(message) == 0:
+            return
+        if isinstance(message, str):
+            message = message.encode("ascii")
+        msg = b"".join((bytes((int(header.mac_node),)), header.to_bytes(), message))
+        await self._pub.send(msg)
+
+    async def start(self):
+        """
+        Starts the node by creating the sockets and the reader task (if correspond).
+        Must be called from a running event loop.
+        :return: None
+        """
+        if self._context is None:
+            self._context = zmq.asyncio.Context.instance()
+        if self.monitor:
+            self._sub = self._context.socket(zmq.SUB)
+            self._sub.setsockopt(zmq.SUBSCRIBE, bytes((self.node,)) if self.node is not None else b'')
+            self._sub.connect('tcp://{}:{}'.format(self.hub_ip, self.in_port))
+            self._reader_task = asyncio.ensure_future(self._reader())
+        if self.console:
+            self._pub = self._context.socket(zmq.PUB)
+            self._pub.connect('tcp://{}:{}'.format(self.hub_ip, self.out_port))
+
+    async def join(self):
+        """
+        Wait until the reader task finishes
+        :return: None
+        """
+        if self._reader_task is not None:
+            await self._reader_task
+
+    async def stop(self):
+        """
+        Cancel the reader task and close the sockets
+        :return: None
+        """
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            await self._reader_task
+            self._reader_task = None
+        for sock in (self._sub, self._pub):
+            if sock is not None:
+                sock.close(linger=0)
+        self._sub = self._pub = None
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--node", default=9, help="Node address")
+    parser.add_argument("-d", "--ip", default="localhost", help="Hub IP address")
+    parser.add_argument("-i", "--in_port", default="8001", help="Input port")
+    parser.add_argument("-o", "--out_port", default="8002", help="Output port")
+
+    return parser.parse_args()
+
+
+async def main(args):
+    """ Print all messages sent to this node """
+    node = AsyncCspZmqNode(int(args.node), args.ip, args.in_port, args.out_port)
+
+    async def read_message(msg, hdr):
+        print(msg, hdr)
+
+    node.read_message = read_message
+    await node.start()
+    await node.join()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,203 @@
+import zmq
+import argparse
+
+from zmqnode import CspZmqNode
+
+
+class CspZmqRouterNode(CspZmqNode):
+
+    def __init__(self, node, hub_ip='localhost', port="8010", monitor=True, console=False, **kwargs):
+        """
+        CSP ZMQ ROUTER NODE
+        Same as CspZmqNode but connected to a CspZmqRouterHub using DEALER sockets. The reader registers its
+        node address in the hub so it only receives frames sent to this node. The registration is sent again
+        every second without frames, so the node is registered again if the hub restarts.
+        NODE:DEALER(writer) ----> HUB:ROUTER:PORT ----> NODE:DEALER(reader)
+
+        :param node: Int. This node address, None to receive all frames
+        :param hub_ip: Str. Hub node IP address
+        :param port: Str. Hub ROUTER port
+        :param monitor: Bool. Activate reader.
+        :param console: Bool. Activate writer.
+        :param kwargs: Other CspZmqNode parameters
+        """
+        CspZmqNode.__init__(self, node, hub_ip, port, port, monitor, console, **kwargs)
+        self._registration = None
+
+    def _reader_socket(self, ctx, node, port, ip):
+        """
+        Create a DEALER socket and register the node(s) address in the hub
+        :return: ZMQ socket.
+        """
+        sock = ctx.socket(zmq.DEALER)
+        sock.connect('tcp://{}:{}'.format(ip, port))
+        nodes = node if isinstance(node, (list, tuple)) else ([node] if node is not None else [])
+        self._registration = [b'', bytes(int(n) for n in nodes)]
+        sock.send_multipart(self._registration)
+        return sock
+
+    def _reader_idle(self, sock):
+        """
+        Register again. A restarted hub does not know this node, and the DEALER reconnects without sending
+        the registration, so no frames arrive until it is sent again. Registering twice has no effect.
+        :param sock: ZMQ socket. Reader socket
+        :return: None
+        """
+        try:
+            sock.send_multipart(self._registration, zmq.NOBLOCK)
+        except zmq.error.Again:
+            # Not connected or the hub is slow, a registration is already waiting to be sent
+            pass
+
+    def _writer_socket(self, ctx, port, ip):
+        """
+        Create a DEALER socket to send frames to the hub
+        :return: ZMQ socket.
+        """
+        sock = ctx.socket(zmq.DEALER)
+        sock.connect('tcp://{}:{}'.format(ip, port))
+        return sock
+
+
+class CspZmqRouterHub(object):
+
+    def __init__(self, port="8010", mon_port="8003", monitor=True):
+        """
+        CSP ZMQ ROUTER HUB
+        Delivers each frame only to the peers registered for its destination (MAC byte), instead of sending
+        every frame to all subscribers. Peers registered without address, and the monitor socket, receive
+        all frames. Nodes connect using CspZmqRouterNode.
+        NODE:DEALER(writer) ----> HUB:ROUTER:PORT ----> NODE:DEALER(reader)
+                                                  \\---> HUB:PUB:MON_PORT
+
+        Peers register sending [b'', <node addresses>] (an empty list for all nodes) and data frames are sent
+        as a single frame: MAC byte, CSP header and data.
+
+        :param port: Str. ROUTER port, nodes readers and writers connect here
+        :param mon_port: Str. Monitor port, PUB socket with all frames
+        :param monitor: Bool. Activate monitor socket
+        """
+        self.port = port
+        self.mon_port = mon_port
+        self.monitor = monitor
+        self.frames = 0
+        self.egress_bytes = 0
+        self.dropped = 0
+        self._peers = {}
+        self._broadcast = []
+        self._run = True
+
+    def register(self, peer, nodes):
+        """
+        Register a peer to receive the frames sent to a list of nodes
+        :param peer: Bytes. Peer routing id
+        :param nodes: Bytes. Node addresses, empty to receive all frames
+        :return: None
+
+        >>> hub = CspZmqRouterHub()
+        >>> hub.register(b'peer_a', bytes([10, 11]))
+        >>> hub.register(b'peer_b', b'')
+        >>> hub.peers(10), hub.peers(12)
+        ([b'peer_a', b'peer_b'], [b'peer_b'])
+        """
+        self.unregister(peer)
+        if not nodes:
+            self._broadcast.append(peer)
+        for node in nodes:
+            self._peers.setdefault(node, []).append(peer)
+
+    def unregister(self, peer):
+        """
+        Remove a peer from the routing table
+        :param peer: Bytes. Peer routing id
+        :return: None
+        """
+        for peers in list(self._peers.values()) + [self._broadcast]:
+            if peer in peers:
+                peers.remove(peer)
+
+    def peers(self, node):
+        """
+        Peers that receive the frames sent to a node
+        :param node: Int. Node address (MAC byte)
+        :return: List. Peers routing ids
+        """
+        return self._peers.get(node, []) + self._broadcast
+
+    def start(self):
+        """
+        Start the routing hub (blocking)
+        :return: None
+        """
+        ctx = zmq.Context()
+        router = ctx.socket(zmq.ROUTER)
+        # Raise an error if a peer is gone instead of silently dropping frames
+        router.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        router.setsockopt(zmq.RCVTIMEO, 1000)
+        router.bind('tcp://*:{}'.format(self.port))
+
+        s_mon = None
+        if self.monitor:
+            s_mon = ctx.socket(zmq.PUB)
+            s_mon.bind('tcp://*:{}'.format(self.mon_port))
+
+        print("Router hub started!")
+        try:
+            while self._run:
+                try:
+                    msg = router.recv_multipart()
+                except zmq.error.Again:
+                    continue
+
+                if len(msg) == 3:
+                    self.register(msg[0], msg[2])
+                    continue
+
+                frame = msg[1]
+                if not frame:
+                    continue
+                self.frames += 1
+                if s_mon is not None:
+                    s_mon.send(frame)
+                for peer in self.peers(frame[0]):
+                    try:
+                        router.send_multipart([peer, frame], zmq.NOBLOCK)
+                        self.egress_bytes += len(frame)
+                    except zmq.error.Again:
+                        self.dropped += 1
+                    except zmq.error.ZMQError:
+                        # Peer disconnected
+                        self.unregister(peer)
+                        self.dropped += 1
+
+        except KeyboardInterrupt as e:
+            print("Main:", e)
+
+        finally:
+            router.close(linger=0)
+            if s_mon is not None:
+                s_mon.close(linger=0)
+            ctx.term()
+            print("Router hub stopped!")
+
+    def stop(self):
+        self._run = False
+
+
+def get_parameters():
+    """ Parse command line parameters """
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-p", "--port", default="8010", help="Router port")
+    parser.add_argument("-m", "--mon_port", default="8003", help="Monitor port")
+    parser.add_argument("--mon", action="store_true", help="Enable monitor socket")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    # Get arguments
+    args = get_parameters()
+    print(args)
+    hub = CspZmqRouterHub(args.port, args.mon_port, args.mon)
+    hub.start()
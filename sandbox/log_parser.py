@@ -1,6 +1,14 @@
+import io
+import os
 import re
+import csv
+import time
+import locale
+import json
+import hashlib
 import argparse
-import pandas as pd
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
 
 # General expressions
 re_error = re.compile(r'\[ERROR\]\[(\d+)\]\[(\w+)\](.+)')
@@ -13,6 +21,20 @@ re_verbose = re.compile(r'\[VERB \]\[(\d+)\]\[(\w+)\](.+)')
 re_cmd_run = re.compile(r'\[INFO \]\[(\d+)]\[Executer\] Running the command: (.+)')
 re_cmd_result = re.compile(r'\[INFO \]\[(\d+)]\[Executer\] Command result: (\d+)')
 
+# Any log entry, for the follow mode aggregates
+re_level = re.compile(r'\[(ERROR|WARN |INFO |DEBUG|VERB )\]\[(\d+)\]\[(\w+)\]')
+
+# Literal text every match contains. Lines without it are not searched
+markers = {
+    re_error: '[ERROR][',
+    re_warning: '[WARN ][',
+    re_info: '[INFO ][',
+    re_debug: '[DEBUG][',
+    re_verbose: '[VERB ][',
+    re_cmd_run: '[Executer] Running the command: ',
+    re_cmd_result: '[Executer] Command result: ',
+}
+
 
 def get_parameters():
     """
@@ -29,34 +51,399 @@ def get_parameters():
     # Specific expressions
     parser.add_argument('--cmd-run', action="store_const", const=re_cmd_run)
     parser.add_argument('--cmd-result', action="store_const", const=re_cmd_result)
+    # Reader options
+    parser.add_argument('--chunk-size', type=int, default=1 << 20, help="Bytes read at once")
+    parser.add_argument('--workers', type=int, default=0, help="Parse in N processes, 0 to parse serially")
+    parser.add_argument('--bench', action="store_true", help="Compare serial and 1, 2, 4, 8 workers")
+    # Follow mode
+    parser.add_argument('--follow', action="store_true", help="Follow the log as tail -F, showing statistics")
+    parser.add_argument('--checkpoint', type=str, help="Follow mode checkpoint file (default <file>.ckpt)")
+    parser.add_argument('--interval', type=float, default=5, help="Follow mode seconds between reports")
+    parser.add_argument('--window', type=int, default=60, help="Follow mode rates window in seconds")
 
     return parser.parse_args()
 
 
-def parse_text(text, regexp):
-    return regexp.findall(text)
+class CsvOutput(object):
+    """
+    Writes parsed logs to a csv file as they are found, in the same format as pandas.DataFrame(logs).to_csv:
+    a header with the index and group numbers, then one row per log with its index.
+    """
+    def __init__(self, file):
+        self.file = open(file, 'w', newline='')
+        self.writer = csv.writer(self.file, lineterminator='\n')
+        self.count = 0
+
+    def write(self, groups):
+        if self.count == 0:
+            self.writer.writerow([''] + list(range(len(groups))))
+        self.writer.writerow((self.count,) + groups)
+        self.count += 1
 
+    def write_text(self, text, columns):
+        """ Write rows already formatted as csv, without index (see parse_range) """
+        lines = text.split('\n')
+        lines.pop()
+        if not lines:
+            return
+        if self.count == 0:
+            self.writer.writerow([''] + list(range(columns)))
+        self.file.write(''.join(map('{},{}\n'.format, range(self.count, self.count + len(lines)), lines)))
+        self.count += len(lines)
 
-def save_parsed(logs, file, format=None):
-    df = pd.DataFrame(logs)
-    # print(df)
-    df.to_csv(file)
+    def close(self):
+        if self.count == 0:
+            # Empty DataFrame
+            self.file.write('""\n')
+        self.file.close()
 
 
-if __name__ == "__main__":
-    args = get_parameters()
+def parse_lines(lines, parsers):
+    """
+    Parse lines with many regular expressions in a single pass. Every match of a line is written, as
+    regexp.findall over the whole text
+    :param lines: Iterable. Log lines
+    :param parsers: List. [(regexp, output), ...], output.write receives the groups of each match
+    :return: None
 
-    print("Reading file {}...".format(args.file))
-    with open(args.file) as logfile:
-        text = logfile.read()
+    >>> class Print(object):
+    ...     def write(self, groups): print(groups)
+    >>> lines = ["[INFO ][1570724182][Executer] Running the command: test_str_int...",
+    ...          "[INFO ][1570724182][Executer] Command result: 1"]
+    >>> parse_lines(lines, [(re_info, Print()), (re_cmd_result, Print())])
+    ('1570724182', 'Executer', ' Running the command: test_str_int...')
+    ('1570724182', 'Executer', ' Command result: 1')
+    ('1570724182', '1')
+    >>> parse_lines(["[INFO ][1][Executer] Command result: 1 [INFO ][2][Executer] Command result: 0"],
+    ...             [(re_cmd_result, Print())])
+    ('1', '1')
+    ('2', '0')
+    """
+    parsers = [(markers.get(regexp, ''), regexp.finditer, output.write) for regexp, output in parsers]
+    for line in lines:
+        for marker, finditer, write in parsers:
+            if marker in line:
+                for match in finditer(line):
+                    write(match.groups())
 
-    args = vars(args)
-    print(args)
 
-    for type, regexp in args.items():
-        if type is not "file" and regexp is not None:
-            print("Parsing {}...", type)
-            logs = parse_text(text, regexp)
-            save_parsed(logs, args["file"]+type+".csv")
+def parse_file(file, regexps, chunk_size=1 << 20):
+    """
+    Parse a log file with many regular expressions, reading it in chunks of lines, and write one csv file
+    per expression (<file><name>.csv). Memory use does not depend on the file size.
+    :param file: Str. Log file
+    :param regexps: Dict. {name: regexp}
+    :param chunk_size: Int. Bytes read at once (approximately, chunks end at a new line)
+    :return: Dict. {name: number of logs found}
+    """
+    outputs = {name: CsvOutput(file + name + ".csv") for name in regexps}
+    parsers = [(regexps[name], outputs[name]) for name in regexps]
+    try:
+        with open(file) as logfile:
+            while True:
+                lines = logfile.readlines(chunk_size)
+                if not lines:
+                    break
+                parse_lines(lines, parsers)
+    finally:
+        for output in outputs.values():
+            output.close()
+    return {name: output.count for name, output in outputs.items()}
+
+
+class ListOutput(list):
+    """ Keeps parsed logs in memory """
+    write = list.append
+
+
+def split_file(file, range_size):
+    """
+    Split a file in byte ranges ending at a new line
+    :param file: Str. File path
+    :param range_size: Int. Approximate range size in bytes
+    :return: List. [(start, end), ...]
+    """
+    ranges = []
+    size = os.path.getsize(file)
+    with open(file, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + range_size, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_range(file, start, end, regexps):
+    """
+    Parse a byte range of a log file (see split_file). Runs in the worker processes.
+    :param file: Str. Log file
+    :param start: Int. First byte
+    :param end: Int. Last byte + 1
+    :param regexps: Dict. {name: regexp}
+    :return: Dict. {name: (columns, rows formatted as csv, without index)}
+    """
+    with open(file, 'rb') as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    # Same decoding and new lines translation as open(file) in text mode
+    lines = io.StringIO(raw.decode(locale.getpreferredencoding(False)), newline=None)
+    results = {name: ListOutput() for name in regexps}
+    parse_lines(lines, [(regexps[name], results[name]) for name in regexps])
+    # Format here, so the main process only adds the indexes
+    formatted = {}
+    for name, rows in results.items():
+        text = io.StringIO()
+        csv.writer(text, lineterminator='\n').writerows(rows)
+        formatted[name] = (len(rows[0]) if rows else 0, text.getvalue())
+    return formatted
+
+
+def parse_file_parallel(file, regexps, workers, range_size=32 << 20):
+    """
+    Parse a log file in many processes and write the same csv files as parse_file. The file is split in
+    byte ranges at new lines, each range is parsed by a worker and results are merged in order.
+    At most 2 * workers ranges are parsed or waiting to be written at once.
+    :param file: Str. Log file
+    :param regexps: Dict. {name: regexp}
+    :param workers: Int. Number of processes
+    :param range_size: Int. Bytes parsed by each task
+    :return: Dict. {name: number of logs found}
+    """
+    outputs = {name: CsvOutput(file + name + ".csv") for name in regexps}
+
+    def merge(future):
+        for name, (columns, text) in future.result().items():
+            outputs[name].write_text(text, columns)
+
+    try:
+        with ProcessPoolExecutor(workers) as executor:
+            pending = deque()
+            for start, end in split_file(file, range_size):
+                pending.append(executor.submit(parse_range, file, start, end, regexps))
+                if len(pending) >= 2 * workers:
+                    merge(pending.popleft())
+            while pending:
+                merge(pending.popleft())
+    finally:
+        for output in outputs.values():
+            output.close()
+    return {name: output.count for name, output in outputs.items()}
+
+
+def benchmark(file, regexps, chunk_size=1 << 20):
+    """
+    Compare the serial parser with 1, 2, 4 and 8 workers, checking all of them write the same csv files
+    :param file: Str. Log file
+    :param regexps: Dict. {name: regexp}
+    :param chunk_size: Int. Serial parser chunk size
+    :return: None
+    """
+    def digest():
+        return [hashlib.md5(open(file + name + ".csv", 'rb').read()).hexdigest() for name in regexps]
+
+    size = os.path.getsize(file) / 1e6
+    # Ranges small enough to give work to all the workers
+    range_size = min(32 << 20, os.path.getsize(file) // 32 + 1)
+    start = time.perf_counter()
+    parse_file(file, regexps, chunk_size)
+    serial = time.perf_counter() - start
+    expected = digest()
+    print("serial   : {:.3f} s, {:.1f} MB/s".format(serial, size / serial))
+    for workers in (1, 2, 4, 8):
+        start = time.perf_counter()
+        parse_file_parallel(file, regexps, workers, range_size)
+        elapsed = time.perf_counter() - start
+        print("workers {}: {:.3f} s, {:.1f} MB/s, speedup {:.2f}, same output: {}".format(
+            workers, elapsed, size / elapsed, serial / elapsed, digest() == expected))
+
+
+class LogFollower(object):
+
+    def __init__(self, file, checkpoint=None, window=60):
+        """
+        Follows a log file while it is written (as tail -F) keeping running statistics: number of entries per
+        level and module, executed commands, and rates over the last window seconds (using the log timestamps).
+        Only the new bytes are parsed on each poll. The file offset and statistics are saved to a checkpoint
+        file, so a restart resumes where it stopped. If the file is replaced or truncated it is read again
+        from the beginning.
+        :param file: Str. Log file
+        :param checkpoint: Str. Checkpoint file, None to not save checkpoints
+        :param window: Int. Rates window in seconds
+
+        >>> follower = LogFollower("log.txt")
+        >>> follower.parse_lines(["[INFO ][10][Executer] Running the command: obc_get_mem...\\n",
+        ...                       "[ERROR][11][cmdOBC] Error\\n"])
+        >>> follower.counts
+        Counter({('INFO ', 'Executer'): 1, ('ERROR', 'cmdOBC'): 1})
+        >>> follower.rates()
+        {'ERROR': 0.016666666666666666, 'INFO ': 0.016666666666666666, 'commands': 0.016666666666666666}
+        """
+        self.file = file
+        self.checkpoint = checkpoint
+        self.window = window
+        self.inode = None
+        self.offset = 0
+        self.counts = Counter()
+        self.commands = Counter()
+        # {timestamp: Counter({level: n})}
+        self._seconds = {}
+        self._last = 0
+        if checkpoint and os.path.exists(checkpoint):
+            self.load()
+
+    def load(self):
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self.inode = state["inode"]
+        self.offset = state["offset"]
+        self.counts = Counter({tuple(k.split("|")): n for k, n in state["counts"].items()})
+        self.commands = Counter(state["commands"])
+        self._seconds = {int(t): Counter(c) for t, c in state["seconds"].items()}
+        self._last = max(self._seconds, default=0)
+
+    def save(self):
+        state = {
+            "file": self.file,
+            "inode": self.inode,
+            "offset": self.offset,
+            "counts": {"|".join(k): n for k, n in self.counts.items()},
+            "commands": self.commands,
+            "seconds": self._seconds,
+        }
+        # Write and rename, so a crash never leaves a broken checkpoint
+        with open(self.checkpoint + ".tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(self.checkpoint + ".tmp", self.checkpoint)
+
+    def parse_lines(self, lines):
+        """ Update the statistics with new lines """
+        for line in lines:
+            match = re_level.search(line)
+            if not match:
+                continue
+            level, timestamp, module = match.groups()
+            self.counts[(level, module)] += 1
+            second = self._seconds.get(int(timestamp))
+            if second is None:
+                second = self._seconds[int(timestamp)] = Counter()
+            second[level] += 1
+            if markers[re_cmd_run] in line:
+                cmd = re_cmd_run.search(line)
+                if cmd:
+                    self.commands[cmd.group(2).rstrip('.')] += 1
+                    second["commands"] += 1
+            self._last = max(self._last, int(timestamp))
+        # Forget seconds out of the window
+        for timestamp in [t for t in self._seconds if t <= self._last - self.window]:
+            del self._seconds[timestamp]
+
+    def poll(self, chunk_size=1 << 20):
+        """
+        Parse the bytes written since the last poll. Only complete lines are parsed, a partial last line is
+        parsed in the next poll.
+        :param chunk_size: Int. Bytes read at once, longer lines are read in many chunks
+        :return: Int. Number of bytes parsed
+
+        >>> import tempfile
+        >>> with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as log:
+        ...     _ = log.write("[INFO ][10][Executer] Running the command: " + "x" * 100 + "...\\n"
+        ...                   "[ERROR][11][cmdOBC] Error\\n[INFO ][12]")
+        >>> follower = LogFollower(log.name)
+        >>> follower.poll(chunk_size=16), follower.offset
+        (173, 173)
+        >>> follower.counts
+        Counter({('INFO ', 'Executer'): 1, ('ERROR', 'cmdOBC'): 1})
+        >>> os.remove(log.name)
+        """
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return 0
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # New or truncated file
+            self.inode = stat.st_ino
+            self.offset = 0
+        parsed = 0
+        with open(self.file, 'rb') as f:
+            f.seek(self.offset)
+            # Bytes after the last complete line
+            pending = b''
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                data = pending + data
+                end = data.rfind(b'\n') + 1
+                pending = data[end:]
+                if not end:
+                    # Line longer than chunk_size, keep reading
+                    continue
+                text = data[:end].decode(locale.getpreferredencoding(False), errors='replace')
+                self.parse_lines(io.StringIO(text, newline=None))
+                self.offset += end
+                parsed += end
+        if parsed and self.checkpoint:
+            self.save()
+        return parsed
+
+    def rates(self):
+        """
+        Entries per second by level, and executed commands per second, over the last window seconds
+        :return: Dict. {level: rate}
+        """
+        total = Counter()
+        for second in self._seconds.values():
+            total.update(second)
+        return {key: n / self.window for key, n in sorted(total.items())}
+
+    def report(self):
+        """ Print the statistics """
+        print("{} offset {}".format(self.file, self.offset))
+        for (level, module), n in sorted(self.counts.items()):
+            print("  [{}][{}] {}".format(level, module, n))
+        print("  Commands: {}, most executed: {}".format(sum(self.commands.values()),
+                                                         self.commands.most_common(5)))
+        print("  Rates (last {} s): {}".format(self.window, {k: round(v, 3) for k, v in self.rates().items()}))
+
+    def follow(self, interval=5):
+        """
+        Poll the file and report the statistics every interval seconds, until interrupted
+        :param interval: Float. Seconds
+        :return: None
+        """
+        try:
+            while True:
+                self.poll()
+                self.report()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    args = vars(get_parameters())
+    print(args)
 
+    chunk_size = args.pop("chunk_size")
+    workers = args.pop("workers")
+    bench = args.pop("bench")
+    file = args.pop("file")
+    follow = args.pop("follow")
+    checkpoint = args.pop("checkpoint") or file + ".ckpt"
+    interval = args.pop("interval")
+    window = args.pop("window")
+    if follow:
+        LogFollower(file, checkpoint, window).follow(interval)
+        exit(0)
 
+    regexps = {type: regexp for type, regexp in args.items() if regexp is not None}
+    print("Parsing {} {}...".format(file, list(regexps)))
+    if bench:
+        benchmark(file, regexps, chunk_size)
+    elif workers:
+        print(parse_file_parallel(file, regexps, workers))
+    else:
+        print(parse_file(file, regexps, chunk_size))
@@ -0,0 +1,215 @@
+import os
+import re
+import argparse
+
+import numpy as np
+
+# Executer entries. Results can be negative (CMD_ERROR), unlike log_parser.re_cmd_result
+re_executer = re.compile(r'\[INFO \]\[(\d+)]\[Executer\] '
+                         r'(?:Running the command: (.*?)(?:\.\.\.)?|Command result: (-?\d+))$')
+marker = '[Executer] '
+
+# Result of commands that were running when the log ended, or that never logged their result
+NO_RESULT = -128
+
+CMD_OK = 1
+
+
+def parse_timeline(file, chunk_size=1 << 20):
+    """
+    Pair each "Running the command" entry with the next "Command result", as the Executer runs one command
+    at a time, and build the commands timeline.
+    Log timestamps have a resolution of one second, so latencies are integer seconds.
+    :param file: Str. Log file
+    :param chunk_size: Int. Bytes read at once
+    :return: Tuple. (names, columns) names is a list of command names, columns a dict of numpy arrays
+        cmd (index in names), start, end, latency, result and line (of the running entry)
+    """
+    names = {}
+    cmd, start, end, result, line = [], [], [], [], []
+    running = False
+    n_line = 0
+    with open(file) as logfile:
+        while True:
+            lines = logfile.readlines(chunk_size)
+            if not lines:
+                break
+            for text in lines:
+                n_line += 1
+                if marker not in text:
+                    continue
+                match = re_executer.search(text)
+                if not match:
+                    continue
+                timestamp, name, cmd_result = match.groups()
+                if name is not None:
+                    if running:
+                        # Previous command without result
+                        end.append(start[-1])
+                        result.append(NO_RESULT)
+                    cmd.append(names.setdefault(name, len(names)))
+                    start.append(int(timestamp))
+                    line.append(n_line)
+                    running = True
+                elif running:
+                    end.append(int(timestamp))
+                    result.append(int(cmd_result))
+                    running = False
+    if running:
+        end.append(start[-1])
+        result.append(NO_RESULT)
+
+    columns = {
+        'cmd': np.array(cmd, dtype=np.uint32),
+        'start': np.array(start, dtype=np.int64),
+        'end': np.array(end, dtype=np.int64),
+        'result': np.array(result, dtype=np.int32),
+        'line': np.array(line, dtype=np.uint64),
+    }
+    columns['latency'] = columns['end'] - columns['start']
+    return list(names), columns
+
+
+class Timeline(object):
+
+    def __init__(self, names, columns):
+        """
+        Commands timeline with indexes to query it. Use Timeline.build to parse a log file, Timeline.load
+        to open a saved timeline.
+        :param names: List. Command names
+        :param columns: Dict. Numpy arrays, see parse_timeline. The by_latency and by_cmd indexes are built
+            if missing
+
+        >>> tl = Timeline(['a', 'b'], {'cmd': np.array([0, 1, 0]), 'start': np.array([10, 11, 14]),
+        ...                            'end': np.array([11, 14, 14]), 'result': np.array([1, 1, -1]),
+        ...                            'line': np.array([1, 3, 5]), 'latency': np.array([1, 3, 0])})
+        >>> [row['command'] for row in tl.slowest(2)]
+        ['b', 'a']
+        >>> tl.stats()[0]['success_rate']
+        0.5
+        """
+        self.names = list(names)
+        self.columns = columns
+        if 'by_latency' not in columns:
+            columns['by_latency'] = np.argsort(columns['latency'], kind='stable')[::-1].astype(np.uint64)
+        if 'by_cmd' not in columns:
+            by_cmd = np.argsort(columns['cmd'], kind='stable')
+            columns['by_cmd'] = by_cmd.astype(np.uint64)
+            # Each command executions are by_cmd[cmd_offset[i]:cmd_offset[i+1]]
+            columns['cmd_offset'] = np.searchsorted(columns['cmd'][by_cmd], np.arange(len(self.names) + 1))
+
+    @classmethod
+    def build(cls, file, chunk_size=1 << 20):
+        """ Parse a log file """
+        return cls(*parse_timeline(file, chunk_size))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Open a timeline saved with Timeline.save. Columns are memory mapped.
+        :param path: Str. Timeline directory
+        :return: Timeline.
+        """
+        with open(os.path.join(path, "names.txt")) as names:
+            names = names.read().splitlines()
+        columns = {f[:-4]: np.load(os.path.join(path, f), mmap_mode='r')
+                   for f in os.listdir(path) if f.endswith(".npy")}
+        return cls(names, columns)
+
+    def save(self, path):
+        """
+        Save the timeline: one .npy file per column and index, and the command names
+        :param path: Str. Timeline directory
+        :return: None
+        """
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "names.txt"), 'w') as names:
+            names.write("".join(name + "\n" for name in self.names))
+        for key, column in self.columns.items():
+            np.save(os.path.join(path, key + ".npy"), column)
+
+    def __len__(self):
+        return len(self.columns['cmd'])
+
+    def row(self, i):
+        """ Command execution i as a dict """
+        c = self.columns
+        return {'command': self.names[c['cmd'][i]], 'start': int(c['start'][i]), 'latency': int(c['latency'][i]),
+                'result': int(c['result'][i]), 'line': int(c['line'][i])}
+
+    def slowest(self, n=10):
+        """
+        Slowest command executions
+        :param n: Int. Number of executions
+        :return: List. Rows (dict), slowest first
+        """
+        return [self.row(i) for i in self.columns['by_latency'][:n]]
+
+    def executions(self, command):
+        """
+        Executions of a command
+        :param command: Str. Command name
+        :return: List. Rows (dict) in execution order
+        """
+        cmd = self.names.index(command)
+        offset = self.columns['cmd_offset']
+        return [self.row(i) for i in self.columns['by_cmd'][offset[cmd]:offset[cmd + 1]]]
+
+    def stats(self):
+        """
+        Per command statistics: executions, success rate (result CMD_OK), commands without result and
+        latency p50/p95/p99/max in seconds
+        :return: List. One dict per command
+        """
+        c = self.columns
+        offset = c['cmd_offset']
+        stats = []
+        for cmd, name in enumerate(self.names):
+            idx = c['by_cmd'][offset[cmd]:offset[cmd + 1]]
+            if not len(idx):
+                continue
+            latency = c['latency'][idx]
+            result = c['result'][idx]
+            p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+            stats.append({'command': name, 'runs': len(idx), 'success_rate': float(np.mean(result == CMD_OK)),
+                          'no_result': int(np.sum(result == NO_RESULT)), 'p50': float(p50), 'p95': float(p95),
+                          'p99': float(p99), 'max': int(latency.max())})
+        return stats
+
+
+def get_parameters():
+    """
+    Parse script arguments
+    """
+    parser = argparse.ArgumentParser(description="Commands execution timeline from Executer log entries")
+    parser.add_argument('file', type=str, help="Log file, or timeline directory created with --save")
+    parser.add_argument('--save', type=str, help="Save the timeline to this directory")
+    parser.add_argument('--slowest', type=int, default=0, help="Show the N slowest executions")
+    parser.add_argument('--command', type=str, help="Show the executions of a command")
+    parser.add_argument('--stats', action="store_true", help="Show per command statistics")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_parameters()
+
+    if os.path.isdir(args.file):
+        timeline = Timeline.load(args.file)
+    else:
+        timeline = Timeline.build(args.file)
+    print("{} executions of {} commands".format(len(timeline), len(timeline.names)))
+    if args.save:
+        timeline.save(args.save)
+
+    if args.stats:
+        print("{:30s} {:>6s} {:>7s} {:>6s} {:>6s} {:>6s} {:>6s} {:>6s}".format(
+            "command", "runs", "success", "no_res", "p50", "p95", "p99", "max"))
+        for s in timeline.stats():
+            print("{command:30s} {runs:6d} {success_rate:7.1%} {no_result:6d} {p50:6.1f} {p95:6.1f} {p99:6.1f} "
+                  "{max:6d}".format(**s))
+    for row in timeline.slowest(args.slowest):
+        print(row)
+    if args.command:
+        for row in timeline.executions(args.command):
+            print(row)
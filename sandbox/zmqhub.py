@@ -1,4 +1,5 @@
 import zmq
+import json
 import argparse
 from threading import Thread
 
@@ -86,6 +87,48 @@ def console(port="8001"):
         except Exception as e:
             print(e)
 
+def proxy_steerable(xpub_out, xsub_in, s_mon, s_ctrl):
+    """
+    XPUB-XSUB proxy controlled by commands in a REP socket (blocking)
+    Commands: PAUSE, RESUME, TERMINATE and STATISTICS. Paused frames wait in the socket queues.
+    Works as zmq.proxy_steerable, which in libzmq 4.3.5 keeps forwarding frames while paused.
+    :param xpub_out: ZMQ XPUB socket. Nodes input
+    :param xsub_in: ZMQ XSUB socket. Nodes output
+    :param s_mon: ZMQ PUB socket. Monitor, can be None
+    :param s_ctrl: ZMQ REP socket. Control commands
+    :return: None
+    """
+    stats = {"frames": 0, "bytes": 0, "paused": False}
+    poller = zmq.Poller()
+    poller.register(xpub_out, zmq.POLLIN)
+    poller.register(xsub_in, zmq.POLLIN)
+    poller.register(s_ctrl, zmq.POLLIN)
+
+    while True:
+        events = dict(poller.poll())
+        if s_ctrl in events:
+            command = s_ctrl.recv()
+            if command == b"PAUSE" and not stats["paused"]:
+                poller.unregister(xsub_in)
+                stats["paused"] = True
+            elif command == b"RESUME" and stats["paused"]:
+                poller.register(xsub_in, zmq.POLLIN)
+                stats["paused"] = False
+            s_ctrl.send_string(json.dumps(stats if command == b"STATISTICS" else {"command": command.decode()}))
+            if command == b"TERMINATE":
+                break
+        if xpub_out in events:
+            # Subscriptions from nodes
+            xsub_in.send_multipart(xpub_out.recv_multipart())
+        if xsub_in in events:
+            msg = xsub_in.recv_multipart()
+            stats["frames"] += 1
+            stats["bytes"] += len(msg[0])
+            xpub_out.send_multipart(msg)
+            if s_mon is not None:
+                s_mon.send_multipart(msg)
+
+
 def get_parameters():
     """ Parse command line parameters """
     parser = argparse.ArgumentParser()
@@ -93,6 +136,7 @@ def get_parameters():
     parser.add_argument("-i", "--in_port", default="8001", help="Input port")
     parser.add_argument("-o", "--out_port", default="8002", help="Output port")
     parser.add_argument("-m", "--mon_port", default="8003", help="Monitor port")
+    parser.add_argument("-c", "--ctrl_port", default=None, help="Control port (PAUSE, RESUME, TERMINATE, STATISTICS)")
     parser.add_argument("--mon", action="store_true", help="Enable monitor socket") 
     parser.add_argument("--con", action="store_true", help="Enable console task")
 
@@ -126,5 +170,14 @@ if __name__ == "__main__":
         con_th.start()
 
     # Start ZMQ proxy (blocking)
-    zmq.proxy(xpub_out, xsub_in, s_mon)
+    if args.ctrl_port:
+        s_ctrl = context.socket(zmq.REP)
+        s_ctrl.bind('tcp://*:{}'.format(args.ctrl_port))
+        proxy_steerable(xpub_out, xsub_in, s_mon, s_ctrl)
+        # Terminated, close sockets but keep the context to let monitor and console threads finish
+        for sock in (xpub_out, xsub_in, s_mon, s_ctrl):
+            if sock is not None:
+                sock.close(linger=0)
+    else:
+        zmq.proxy(xpub_out, xsub_in, s_mon)
 
@@ -1,26 +1,123 @@
 """
-Simple script that compares the results of 8 tests between a base output
-and the current one. It counts the number of command results equal to 1
-for each file, then it compares those numbers.
+Script that compares the command results of a test log against a base log.
+Each log is read once, line by line, pairing every "Running the command" entry with the next
+"Command result" entry. The comparison reports, per command, the results added, removed or changed
+with references to the log lines. The execution is unsuccessful if the number of successful results
+(Command result: 1) of any command differs between both logs.
 """
 
 __author__ = "Tamara Gutierrez R, Diego Ortego P"
 
 import re
+import argparse
+from collections import Counter
 
-def compare():
-    p = re.compile('Command result: 1')
+re_run = re.compile(r'\[Executer\] Running the command: (.*?)(?:\.\.\.)?$')
+re_result = re.compile(r'\[Executer\] Command result: (-?\d+)')
 
-    with open('test_cmd_log_base.txt', 'r') as myfile1:
-        logfile1=myfile1.read()
+CMD_OK = "1"
+# Result of commands without a result entry (the log ended, or the system was reset)
+NO_RESULT = "none"
+# Line references kept by command and result
+MAX_LINES = 3
 
-    with open('test_cmd_log.txt', 'r') as myfile2:
-        logfile2=myfile2.read()
 
-    if len(p.findall(logfile1)) != len(p.findall(logfile2)):
+def get_parameters():
+    """
+    Parse script arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', nargs='?', default='test_cmd_log_base.txt', help="Base log")
+    parser.add_argument('log', nargs='?', default='test_cmd_log.txt', help="Test log")
+    return parser.parse_args()
+
+
+def read_results(file):
+    """
+    Read the commands results of a log
+    :param file: Str. Log file
+    :return: Tuple. (results, lines) results is a Counter {(command, result): n}, lines a dict
+        {(command, result): [line numbers]} with up to MAX_LINES lines of the running entries
+    """
+    results = Counter()
+    lines = {}
+    running = None
+
+    def add(command, result, line):
+        results[(command, result)] += 1
+        refs = lines.setdefault((command, result), [])
+        if len(refs) < MAX_LINES:
+            refs.append(line)
+
+    with open(file, 'r') as logfile:
+        for n_line, text in enumerate(logfile, 1):
+            if '[Executer] ' not in text:
+                continue
+            match = re_run.search(text)
+            if match:
+                if running:
+                    add(running[0], NO_RESULT, running[1])
+                running = (match.group(1), n_line)
+                continue
+            match = re_result.search(text)
+            if match and running:
+                add(running[0], match.group(1), running[1])
+                running = None
+    if running:
+        add(running[0], NO_RESULT, running[1])
+    return results, lines
+
+
+def by_command(results):
+    commands = {}
+    for (command, result), n in results.items():
+        commands.setdefault(command, Counter())[result] = n
+    return commands
+
+
+def compare(base_file, log_file):
+    """
+    Compare the commands results of two logs and print the differences
+    :param base_file: Str. Base log
+    :param log_file: Str. Test log
+    :return: Bool. True if every command has the same number of successful results in both logs
+    """
+    base, base_lines = read_results(base_file)
+    log, log_lines = read_results(log_file)
+    base_cmds = by_command(base)
+    log_cmds = by_command(log)
+
+    def refs(lines, command, results):
+        return ", ".join("{} at {}".format(r, lines[(command, r)]) for r in sorted(results))
+
+    success = True
+    for command in sorted(set(base_cmds) | set(log_cmds)):
+        expected = base_cmds.get(command, Counter())
+        found = log_cmds.get(command, Counter())
+        if expected == found:
+            continue
+        if expected[CMD_OK] != found[CMD_OK]:
+            success = False
+        if not found:
+            print("[Logs Comparator] Removed {}: {}".format(command, refs(base_lines, command, expected)))
+        elif not expected:
+            print("[Logs Comparator] Added {}: {}".format(command, refs(log_lines, command, found)))
+        else:
+            print("[Logs Comparator] Changed {}: {} -> {}".format(command, dict(expected), dict(found)))
+            if expected - found:
+                print("    Base: {}".format(refs(base_lines, command, expected - found)))
+            if found - expected:
+                print("    Test: {}".format(refs(log_lines, command, found - expected)))
+
+    print("[Logs Comparator] Successful results: {} base, {} test".format(
+        sum(c[CMD_OK] for c in base_cmds.values()), sum(c[CMD_OK] for c in log_cmds.values())))
+    return success
+
+
+if __name__ == "__main__":
+    args = get_parameters()
+    if not compare(args.base, args.log):
         print("[Logs Comparator] Unsuccessful execution")
         exit(1)
     print("[Logs Comparator] Successful execution")
     exit(0)
-
-compare()